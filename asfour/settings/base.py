@@ -78,7 +78,6 @@ TEMPLATEDIRS = ['templates', '/templates']
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -124,6 +123,42 @@ CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Interactive sends, webhook side-effects and bulk fan-out each 
+# have their own queue and worker pool (see Procfile)
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_ROUTES = {
+    'messenger.tasks.task_send_sms': {'queue': 'interactive'},
+    'messenger.tasks.task_send_email': {'queue': 'webhooks'},
+    'messenger.tasks.process_response': {'queue': 'webhooks'},
+    'messenger.tasks.apply_status_callbacks': {'queue': 'webhooks'},
+    'messenger.tasks.send_messages': {'queue': 'bulk'},
+    'messenger.tasks.finish_messages': {'queue': 'bulk'},
+    'messenger.tasks.release_batches': {'queue': 'bulk'},
+    'messenger.tasks.import_contacts': {'queue': 'bulk'},
+    'messenger.tasks.export_data': {'queue': 'bulk'},
+}
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Status callbacks are buffered in Redis by the webhook and 
+# written to MessageLog in batches
+CELERY_BEAT_SCHEDULE = {
+    'apply-status-callbacks': {
+        'task': 'messenger.tasks.apply_status_callbacks',
+        'schedule': float(os.environ.get('STATUS_DRAIN_INTERVAL', 2)),
+        'options': {'expires': 30},
+    },
+}
+# Recipients per send_messages subtask when a message is sent
+SEND_BATCH_SIZE = int(os.environ.get('SEND_BATCH_SIZE', 250))
+# Recipients sent between MessageLog writes within a batch
+SEND_CHECKPOINT_SIZE = int(os.environ.get('SEND_CHECKPOINT_SIZE', 50))
+# 'sync' sends one request at a time; 'async' keeps up to 
+# SEND_CONCURRENCY requests in flight over a pooled connection
+SEND_ENGINE = os.environ.get('SEND_ENGINE', 'sync')
+SEND_CONCURRENCY = int(os.environ.get('SEND_CONCURRENCY', 20))
+# Base of the callback URLs handed to Twilio
+SITE_URL = os.environ.get('SITE_URL', 'https://www.3asfour.com')
+# Overrides https://api.twilio.com, e.g. for a local stand-in
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', '')
 SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
 EMAIL_HOST = 'smtp.sendgrid.net'
 EMAIL_PORT = 587
@@ -5,6 +5,11 @@ DEBUG = True
 ALLOWED_HOSTS = ['0.0.0.0', '127.0.0.1', '.ngrok.io', 'localhost']
 
 INSTALLED_APPS += ['debug_toolbar']
+# Sync-only, so it stays out of the shared async middleware stack
+MIDDLEWARE = list(MIDDLEWARE)
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+    'debug_toolbar.middleware.DebugToolbarMiddleware')
 
 DATABASES = {
     'default': {
@@ -2,8 +2,9 @@ from django.contrib import admin
 from django.urls import reverse
 from django.utils.html import format_html
 
-from .models import (Autoreply, Contact, Invoice, Message, 
-    MessageLog, Note, Organization, Response, Tag, UserProfile)
+from .models import (Autoreply, Contact, ContactImportJob, ExportJob, 
+    Invoice, Message, MessageLog, Note, Organization, Response, 
+    StatusEvent, Tag, UserProfile)
 
 admin.site.register(Organization)
 
@@ -86,6 +87,14 @@ class MessageLogAdmin(admin.ModelAdmin):
     list_display_links = ('message', 'contact', 'timestamp', 'sender')
     list_filter = ('message__organization', 'contact', 'message' )
 
+@admin.register(StatusEvent)
+class StatusEventAdmin(admin.ModelAdmin):
+    list_display = ('sid', 'message', 'status', 'error_code', 
+        'timestamp')
+    list_display_links = ('sid', 'message', 'status')
+    list_filter = ('status', 'error_code')
+    raw_id_fields = ('message',)
+
 @admin.register(Response)
 class ResponseAdmin(admin.ModelAdmin):
     list_display = ('body', 'contact', 'organization')
@@ -104,5 +113,16 @@ class NoteAdmin(admin.ModelAdmin):
     list_display_links = ('body', 'date', 'author')
     list_filter = ('contact', 'message', 'response', 'author')
 
+@admin.register(ContactImportJob)
+class ContactImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'organization', 'status', 'processed_rows', 
+        'error_count', 'date_created')
+    list_display_links = ('id', 'organization', 'status')
+    list_filter = ('organization', 'status')
 
-
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'organization', 'kind', 'status', 
+        'row_count', 'date_created')
+    list_display_links = ('id', 'organization', 'kind')
+    list_filter = ('organization', 'kind', 'status')
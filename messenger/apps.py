@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MessengerConfig(AppConfig):
     name = 'messenger'
+
+    def ready(self):
+        from . import signals
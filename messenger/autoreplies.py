@@ -0,0 +1,59 @@
+from django.apps import apps
+
+from .cache import forget, get_cached
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+def get_index_key(org_id):
+    return 'autoreplies:{}'.format(org_id)
+
+def build_index(org_id):
+    """
+    Compiles the organization's autoreplies into lookup tables of 
+    normalized keyword -> (reply, tag ids). Prefix keywords are 
+    also indexed by word count so a match checks one key per 
+    distinct length, however many autoreplies there are.
+    """
+    Autoreply = apps.get_model(app_label='messenger', 
+        model_name='Autoreply')
+    autoreplies = Autoreply.objects.filter(organization_id=org_id) \
+        .order_by('id')
+    tag_ids = {}
+    for autoreply_id, tag_id in Autoreply.tags.through.objects \
+        .filter(autoreply__organization_id=org_id) \
+        .values_list('autoreply_id', 'tag_id'):
+        tag_ids.setdefault(autoreply_id, []).append(tag_id)
+    index = {'exact': {}, 'prefix': {}, 'lengths': []}
+    for autoreply in autoreplies:
+        keyword = normalize(autoreply.text)
+        entry = (autoreply.reply, tag_ids.get(autoreply.id, []))
+        index['exact'].setdefault(keyword, entry)
+        if autoreply.match_prefix and keyword:
+            index['prefix'].setdefault(keyword, entry)
+    index['lengths'] = sorted({len(keyword.split(' ')) 
+        for keyword in index['prefix']}, reverse=True)
+    return index
+
+def get_index(org_id):
+    return get_cached(get_index_key(org_id), 
+        lambda: build_index(org_id))
+
+def forget_index(org_id):
+    forget(get_index_key(org_id))
+
+def match(org_id, body):
+    """
+    Returns the (reply, tag ids) for the autoreply matching the 
+    body, preferring exact matches then the longest prefix
+    """
+    index = get_index(org_id)
+    body = normalize(body)
+    if body in index['exact']:
+        return index['exact'][body]
+    words = body.split(' ')
+    for length in index['lengths']:
+        prefix = ' '.join(words[:length])
+        if len(words) >= length and prefix in index['prefix']:
+            return index['prefix'][prefix]
+    return None
@@ -0,0 +1,42 @@
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+
+# Seconds a process trusts its own copy before rechecking the 
+# shared cache, which is cleared whenever the source data saves
+LOCAL_TTL = 30
+CACHE_TTL = 60 * 60
+
+_local = {}
+
+def get_cached(key, load):
+    """
+    Returns the value from the process cache, then the shared 
+    Redis cache, and only then by calling load()
+    """
+    entry = _local.get(key)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, CACHE_TTL)
+    _local[key] = (value, time.monotonic() + LOCAL_TTL)
+    return value
+
+def forget(key):
+    _local.pop(key, None)
+    cache.delete(key)
+
+def get_organization_key(pk):
+    return 'organization:{}'.format(pk)
+
+def get_organization(pk):
+    Organization = apps.get_model(app_label='messenger', 
+        model_name='Organization')
+    return get_cached(get_organization_key(int(pk)), 
+        lambda: Organization.objects.get(id=pk))
+
+def forget_organization(pk):
+    forget(get_organization_key(pk))
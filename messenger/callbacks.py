@@ -0,0 +1,184 @@
+import datetime
+import json
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .functions import get_redis
+
+CALLBACK_KEY = 'callbacks:status'
+# Callbacks applied per drain batch, and batches per drain run
+DRAIN_BATCH_SIZE = 2000
+DRAIN_MAX_BATCHES = 25
+# send_messages writes logs a checkpoint at a time, so callbacks can
+# arrive before their sid is logged; they wait this long for it
+HOLD_SECONDS = 60 * 10
+
+# Twilio can deliver callbacks out of order, so a status only
+# replaces one that ranks below it
+STATUS_RANKS = {
+    'accepted': 0,
+    'scheduled': 0,
+    'queued': 1,
+    'sending': 2,
+    'sent': 3,
+    'canceled': 4,
+    'failed': 4,
+    'undelivered': 4,
+    'delivered': 4,
+    'read': 5,
+}
+
+def get_rank(status):
+    return STATUS_RANKS.get(status, 0)
+
+def push_status(callback):
+    """
+    Buffers a status callback for the next drain. Without Redis
+    the update is applied straight away.
+    """
+    callback = dict(callback, timestamp=timezone.now().isoformat())
+    conn = get_redis()
+    if conn is None:
+        return apply_statuses([callback])
+    conn.rpush(CALLBACK_KEY, json.dumps(callback))
+
+def pop_statuses(count=DRAIN_BATCH_SIZE):
+    """Atomically takes up to count buffered callbacks"""
+    pipe = get_redis().pipeline()
+    pipe.lrange(CALLBACK_KEY, 0, count - 1)
+    pipe.ltrim(CALLBACK_KEY, count, -1)
+    items, _ = pipe.execute()
+    return [json.loads(item) for item in items]
+
+def requeue_statuses(callbacks):
+    """Puts callbacks back at the head of the buffer"""
+    if callbacks:
+        get_redis().lpush(CALLBACK_KEY,
+            *[json.dumps(callback) for callback in reversed(callbacks)])
+
+def hold_unlogged(callbacks):
+    """
+    Splits callbacks into those ready to apply and those whose sid 
+    isn't logged yet, which are held until HOLD_SECONDS have passed
+    """
+    MessageLog = apps.get_model(app_label='messenger',
+        model_name='MessageLog')
+    logged = set(MessageLog.objects.filter(sid__in={
+        callback.get('MessageSid') for callback in callbacks
+    }).values_list('sid', flat=True))
+    cutoff = timezone.now() - datetime.timedelta(seconds=HOLD_SECONDS)
+    ready, held = [], []
+    for callback in callbacks:
+        sid = callback.get('MessageSid')
+        if not sid or sid in logged or \
+            parse_datetime(callback['timestamp']) < cutoff:
+            ready.append(callback)
+        else:
+            held.append(callback)
+    return ready, held
+
+def coalesce(callbacks):
+    """Keeps the most advanced status seen for each sid"""
+    latest = {}
+    for callback in callbacks:
+        sid = callback.get('MessageSid')
+        status = callback.get('MessageStatus')
+        if not sid or not status:
+            continue
+        if get_rank(status) >= get_rank(latest.get(sid, '')):
+            latest[sid] = status
+    return latest
+
+def get_events(callbacks, message_ids):
+    """Builds unsaved StatusEvent rows, one per callback"""
+    StatusEvent = apps.get_model(app_label='messenger',
+        model_name='StatusEvent')
+    events = []
+    for callback in callbacks:
+        code = StatusEvent.get_status_code(
+            callback.get('MessageStatus'))
+        if code is None or not callback.get('MessageSid'):
+            continue
+        error_code = str(callback.get('ErrorCode') or '')
+        events.append(StatusEvent(
+            sid=callback['MessageSid'],
+            message_id=message_ids.get(callback['MessageSid']),
+            status=code,
+            error_code=int(error_code) if error_code.isdigit() else None,
+            timestamp=parse_datetime(callback['timestamp']),
+        ))
+    return events
+
+def link_events(sids, message_id):
+    """
+    Attaches events recorded before their sid was logged, after 
+    the hold expired or without Redis, to the sid's message
+    """
+    StatusEvent = apps.get_model(app_label='messenger',
+        model_name='StatusEvent')
+    sids = [sid for sid in sids if sid]
+    if sids:
+        StatusEvent.objects.filter(sid__in=sids, 
+            message__isnull=True).update(message_id=message_id)
+
+def apply_statuses(callbacks):
+    """
+    Records a batch of callbacks as StatusEvents and updates 
+    MessageLog with one UPDATE per distinct status. Returns the 
+    number of MessageLog rows changed.
+    """
+    MessageLog = apps.get_model(app_label='messenger',
+        model_name='MessageLog')
+    StatusEvent = apps.get_model(app_label='messenger',
+        model_name='StatusEvent')
+    latest = coalesce(callbacks)
+    message_ids = dict(MessageLog.objects.filter(
+        sid__in=list(latest)).values_list('sid', 'message_id'))
+    by_status = {}
+    for sid, status in latest.items():
+        by_status.setdefault(status, []).append(sid)
+    updated = 0
+    with transaction.atomic():
+        StatusEvent.objects.bulk_create(
+            get_events(callbacks, message_ids))
+        for status, sids in by_status.items():
+            ahead = [other for other, rank in STATUS_RANKS.items()
+                if rank > get_rank(status)]
+            updated += MessageLog.objects.filter(sid__in=sids) \
+                .exclude(twilio_status__in=ahead) \
+                .update(twilio_status=status)
+    return updated
+
+def drain_statuses(batch_size=DRAIN_BATCH_SIZE,
+        max_batches=DRAIN_MAX_BATCHES):
+    """
+    Applies buffered callbacks until the buffer is empty. Held 
+    callbacks go back on the end of the buffer for the next drain.
+    """
+    conn = get_redis()
+    if conn is None:
+        return 0
+    updated = 0
+    held = []
+    try:
+        for _ in range(max_batches):
+            callbacks = pop_statuses(batch_size)
+            if not callbacks:
+                break
+            try:
+                ready, waiting = hold_unlogged(callbacks)
+                updated += apply_statuses(ready)
+            except Exception:
+                requeue_statuses(callbacks)
+                raise
+            held += waiting
+            if len(callbacks) < batch_size:
+                break
+    finally:
+        if held:
+            conn.rpush(CALLBACK_KEY,
+                *[json.dumps(callback) for callback in held])
+    return updated
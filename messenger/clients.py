@@ -0,0 +1,59 @@
+import threading
+
+from django.conf import settings
+
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+TWILIO_API_URL = 'https://api.twilio.com'
+
+_clients = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+def get_api_url(url):
+    """Points Twilio API requests at TWILIO_API_BASE_URL, if set"""
+    base_url = settings.TWILIO_API_BASE_URL
+    if base_url and url.startswith(TWILIO_API_URL):
+        return base_url.rstrip('/') + url[len(TWILIO_API_URL):]
+    return url
+
+class HttpClient(TwilioHttpClient):
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(
+            method, get_api_url(url), *args, **kwargs)
+
+class AsyncHttpClient(AsyncTwilioHttpClient):
+
+    async def request(self, method, url, *args, **kwargs):
+        return await super().request(
+            method, get_api_url(url), *args, **kwargs)
+
+def get_client(organization):
+    """
+    Returns the process's Twilio client for the organization, 
+    replacing it when the organization's credentials change so 
+    keep-alive connections are reused between calls
+    """
+    account_sid, auth_token, phone = organization.get_credentials()
+    credentials = (account_sid, auth_token)
+    with _lock:
+        entry = _clients.get(organization.id)
+        if entry and entry[0] == credentials:
+            _stats['hits'] += 1
+            return entry[1]
+        _stats['misses'] += 1
+        client = Client(account_sid, auth_token, 
+            http_client=HttpClient(pool_connections=True))
+        _clients[organization.id] = (credentials, client)
+    return client
+
+def forget_client(organization_id):
+    with _lock:
+        _clients.pop(organization_id, None)
+
+def get_client_stats():
+    with _lock:
+        return dict(_stats, size=len(_clients))
@@ -1,31 +1,103 @@
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse, HttpResponseForbidden
 from functools import wraps
 from twilio import twiml
 from twilio.request_validator import RequestValidator
 
-from .models import Organization
+from .cache import get_organization
+from .functions import get_redis
 
 import os
 
-def validate_twilio_request(f):
-    """Validates incoming requests originated from Twilio"""
-    @wraps(f)
-    def decorated_function(request, *args, **kwargs):
-        # Create an instance of the RequestValidator class
-        org = Organization.objects.get(id=kwargs.get('pk'))
-        validator = RequestValidator(org.twilio_secret)
-
-        # Validate the request using its URL, POST data,
-        # and X-TWILIO-SIGNATURE header
-        request_valid = validator.validate(
-            request.build_absolute_uri(),
-            request.POST,
-            request.META.get('HTTP_X_TWILIO_SIGNATURE', ''))
-
-        # Continue processing the request if it's valid, 
+# Twilio gives up retrying well within a day
+DEDUPE_TTL = 60 * 60 * 24
+
+def get_validated_organization(request, pk):
+    """
+    Returns the organization a webhook is for, or None if the
+    request wasn't signed with its Twilio secret
+    """
+    org = get_organization(pk)
+    validator = RequestValidator(org.twilio_secret)
+
+    # Validate the request using its URL, POST data,
+    # and X-TWILIO-SIGNATURE header
+    request_valid = validator.validate(
+        request.build_absolute_uri(),
+        request.POST,
+        request.META.get('HTTP_X_TWILIO_SIGNATURE', ''))
+    if request_valid:
+        return org
+    return None
+
+def validate_twilio_request(method):
+    """Validates requests to an async webhook handler originated from Twilio"""
+    @wraps(method)
+    async def decorated_method(self, request, *args, **kwargs):
+        org = await sync_to_async(get_validated_organization)(
+            request, kwargs.get('pk'))
+
+        # Continue processing the request if it's valid,
         # return a 403 error if it's not
-        if request_valid:
-            return f(request, *args, **kwargs)
-        else:
+        if org is None:
             return HttpResponseForbidden()
-    return decorated_function
\ No newline at end of file
+        request.organization = org
+        return await method(self, request, *args, **kwargs)
+    return decorated_method
+
+def get_dedupe_key(request):
+    """Identifies one delivery of a webhook, or None if it can't"""
+    sid = request.POST.get('MessageSid') or request.POST.get('CallSid')
+    if not sid:
+        return None
+    status = (request.POST.get('MessageStatus') or
+        request.POST.get('CallStatus') or
+        request.POST.get('SmsStatus') or '')
+    return 'webhook:{0}:{1}:{2}'.format(request.path, sid, status)
+
+def claim_request(request):
+    """
+    Claims a webhook delivery. Returns its key, and for a retry
+    the first delivery's response body, empty while still in flight.
+    """
+    conn = get_redis()
+    key = get_dedupe_key(request)
+    if conn is None or key is None:
+        return None, None
+    if conn.set(key, '', nx=True, ex=DEDUPE_TTL):
+        return key, None
+    return key, conn.get(key) or b''
+
+def finish_request(key, response=None):
+    """Stores a handled delivery's response, or releases its claim"""
+    conn = get_redis()
+    if response is not None and 200 <= response.status_code < 300 \
+        and not response.streaming:
+        conn.set(key, response.content, ex=DEDUPE_TTL)
+    else:
+        # Let Twilio's retry through
+        conn.delete(key)
+
+def deduplicate_twilio_request(method):
+    """
+    Answers Twilio's retries of a webhook with the first delivery's
+    response instead of handling them again
+    """
+    @wraps(method)
+    async def decorated_method(self, request, *args, **kwargs):
+        key, replay = await sync_to_async(claim_request,
+            thread_sensitive=False)(request)
+        if replay is not None:
+            return HttpResponse(replay)
+        if key is None:
+            return await method(self, request, *args, **kwargs)
+        try:
+            response = await method(self, request, *args, **kwargs)
+        except Exception:
+            await sync_to_async(finish_request,
+                thread_sensitive=False)(key)
+            raise
+        await sync_to_async(finish_request,
+            thread_sensitive=False)(key, response)
+        return response
+    return decorated_method
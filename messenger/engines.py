@@ -0,0 +1,118 @@
+import asyncio
+
+from django.conf import settings
+
+from twilio.rest import Client
+
+from .clients import AsyncHttpClient, get_client
+from .ratelimit import athrottled_create, throttled_create
+
+def get_recipient(message, contact):
+    if message.method == message.WHATSAPP:
+        return 'whatsapp:{}'.format(contact.phone)
+    else:
+        return contact.phone
+
+def send_sync(message, contacts, kwargs, size):
+    """
+    Sends to each contact in turn, yielding a (contact, sid, error) 
+    tuple for every recipient, size results at a time
+    """
+    client = get_client(message.organization)
+    verb = message.get_client_verb()
+    client_action = getattr(client, verb)
+    results = []
+    for contact in contacts:
+        try:
+            msg = throttled_create(client_action, 
+                message.organization, verb, 
+                to=get_recipient(message, contact), **kwargs)
+            sid = getattr(msg, 'sid', None)
+            error = ""
+            print('sent!')
+        except Exception as e:
+            sid = ""
+            error = e
+            print(error)
+        results.append((contact, sid, error))
+        if len(results) == size:
+            yield results
+            results = []
+    if results:
+        yield results
+
+async def _start_sends(message, contacts, kwargs):
+    """
+    Schedules a send to every contact on the running loop. Results 
+    are put on the returned queue as they complete.
+    """
+    account_sid, auth_token, phone = message.organization \
+        .get_credentials()
+    http_client = AsyncHttpClient()
+    client = Client(account_sid, auth_token, 
+        http_client=http_client)
+    verb = message.get_client_verb()
+    client_action = getattr(client, verb)
+    semaphore = asyncio.Semaphore(settings.SEND_CONCURRENCY)
+    results = asyncio.Queue()
+
+    async def send_one(contact):
+        async with semaphore:
+            try:
+                msg = await athrottled_create(client_action, 
+                    message.organization, verb, 
+                    to=get_recipient(message, contact), **kwargs)
+                sid = getattr(msg, 'sid', None)
+                error = ""
+            except Exception as e:
+                sid = ""
+                error = e
+                print(error)
+            await results.put((contact, sid, error))
+
+    tasks = [asyncio.ensure_future(send_one(contact)) 
+        for contact in contacts]
+    return http_client, tasks, results
+
+async def _collect(results, count):
+    return [await results.get() for _ in range(count)]
+
+async def _stop_sends(http_client, tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await http_client.close()
+
+def send_async(message, contacts, kwargs, size):
+    """
+    Sends to up to SEND_CONCURRENCY contacts at a time, yielding 
+    a (contact, sid, error) tuple for every recipient, size results 
+    at a time in the order they complete. One event loop and aiohttp 
+    session serve the whole batch; sends stay in flight while the 
+    caller handles each yield.
+    """
+    contacts = list(contacts)
+    loop = asyncio.new_event_loop()
+    try:
+        http_client, tasks, results = loop.run_until_complete(
+            _start_sends(message, contacts, kwargs))
+        try:
+            remaining = len(contacts)
+            while remaining:
+                count = min(size, remaining)
+                yield loop.run_until_complete(
+                    _collect(results, count))
+                remaining -= count
+        finally:
+            loop.run_until_complete(_stop_sends(http_client, tasks))
+    finally:
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+ENGINES = {
+    'sync': send_sync,
+    'async': send_async,
+}
+
+def get_engine():
+    return ENGINES[settings.SEND_ENGINE]
@@ -0,0 +1,88 @@
+import csv
+import gzip
+import io
+
+from uuid import uuid4
+
+from django.apps import apps
+from django.utils import timezone
+
+from .functions import (export_contacts, export_message_logs, 
+    export_responses)
+
+# How long emailed download links stay valid (S3 allows up to 7 days)
+LINK_TTL = 60 * 60 * 24 * 3
+
+def get_rows(job):
+    """The CSV rows for a job, read lazily from the database"""
+    Contact = apps.get_model(app_label='messenger', 
+        model_name='Contact')
+    Response = apps.get_model(app_label='messenger', 
+        model_name='Response')
+    MessageLog = apps.get_model(app_label='messenger', 
+        model_name='MessageLog')
+    if job.kind == job.CONTACTS:
+        return export_contacts(Contact.objects.filter(
+            organization_id=job.organization_id))
+    model, export = {
+        job.RESPONSES: (Response, export_responses),
+        job.MESSAGE_LOGS: (MessageLog, export_message_logs),
+    }[job.kind]
+    queryset = model.objects.filter(organization_id=job.organization_id)
+    if job.message_id:
+        queryset = queryset.filter(message_id=job.message_id)
+    return export(queryset)
+
+def write_export(job):
+    """
+    Streams the job's rows as gzipped CSV into its storage, which 
+    uploads S3 files in multipart chunks as they fill. Returns the 
+    stored name and the number of rows written.
+    """
+    name = 'exports/{0}/{1}/{2}.gz'.format(job.organization_id, 
+        uuid4().hex, job.get_filename())
+    count = 0
+    with job.file.storage.open(name, 'wb') as upload:
+        with gzip.GzipFile(fileobj=upload, mode='wb') as compressed:
+            text = io.TextIOWrapper(compressed, encoding='utf-8', 
+                newline='')
+            writer = csv.writer(text)
+            for count, row in enumerate(get_rows(job)):
+                writer.writerow(row)
+            text.flush()
+            text.detach()
+    return name, count
+
+def run_export(job):
+    """Runs an export job, marking it finished or failed"""
+    job.status = job.RUNNING
+    job.save(update_fields=['status'])
+    try:
+        job.file.name, job.row_count = write_export(job)
+    except Exception as error:
+        job.status = job.FAILED
+        job.error = str(error)
+        job.date_finished = timezone.now()
+        job.save()
+        raise
+    job.status = job.FINISHED
+    job.date_finished = timezone.now()
+    job.save()
+
+def get_download_url(job, expire=LINK_TTL):
+    """A presigned link that downloads the export as a .csv.gz"""
+    return job.file.storage.url(job.file.name, expire=expire, 
+        parameters={
+            'ResponseContentDisposition': 
+                'attachment; filename="{}.gz"'.format(
+                    job.get_filename()),
+        })
+
+def get_email_content(job, url):
+    return (
+        '<p>Your {0} export of {1} rows is ready.</p>'
+        '<p><a href="{2}">Download it here</a>. The link expires in '
+        '{3} days; after that, download it again from the Exports '
+        'page.</p>'
+    ).format(job.get_kind_display().lower(), job.row_count, url, 
+        LINK_TTL // (60 * 60 * 24))
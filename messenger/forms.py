@@ -1,5 +1,6 @@
 from django import forms
 
+from .membership import get_tag_counts
 from .models import Contact, Message, Organization, Tag
 
 class MessageForm(forms.ModelForm):
@@ -7,7 +8,12 @@ class MessageForm(forms.ModelForm):
         model = Message
         fields = ('name', 'method', 'body', 'attachment', 
             'recording', 'tags', 'contacts', 
-            'request_for_response')
+            'request_for_response', 'send_at', 'delivery_window')
+        widgets = {
+            'send_at': forms.DateTimeInput(
+                attrs={'type': 'datetime-local'}, 
+                format='%Y-%m-%dT%H:%M'),
+        }
 
     def __init__(self, *args, **kwargs):
         user_profile = kwargs.pop('user_profile')
@@ -16,10 +22,12 @@ class MessageForm(forms.ModelForm):
         #     organization=user_profile.organization)
         self.fields['contacts'].queryset = Contact.objects.filter(
             organization=user_profile.organization)
-        tags = Tag.objects.filter(is_active=True,
-            organization=user_profile.organization)
+        tags = list(Tag.objects.filter(is_active=True,
+            organization=user_profile.organization))
+        counts = get_tag_counts(user_profile.organization_id, 
+            [tag.id for tag in tags])
         tag_choices = [
-            (tag.id, f"{tag.name} ({tag.contact_set.count()} contacts)")
+            (tag.id, f"{tag.name} ({counts.get(tag.id, 0)} contacts)")
             for tag in tags
         ]
 
@@ -34,7 +42,7 @@ class OrganizationForm(forms.ModelForm):
         model = Organization
         fields = ('name', 'twilio_api_key', 'twilio_secret',
         'phone', 'response_msg', 'forward_phone', 
-        'forward_email')
+        'forward_email', 'messages_per_second')
         widgets = {
             'twilio_secret': forms.PasswordInput(
                 render_value=True)
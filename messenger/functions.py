@@ -1,6 +1,10 @@
 import os
+import redis
 
 from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import TextField, Value
+from django.db.models.functions import Coalesce, NullIf
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 
@@ -11,6 +15,23 @@ def get_settings_value(name):
         value = os.environ.get(name)
     return value
 
+_redis = None
+
+def get_redis():
+    """
+    Returns a shared connection to the app's Redis instance, 
+    or None when REDIS_URL is not configured
+    """
+    global _redis
+    if _redis is None:
+        url = os.environ.get('REDIS_URL')
+        if url:
+            kwargs = {}
+            if url.startswith('rediss://'):
+                kwargs['ssl_cert_reqs'] = None
+            _redis = redis.Redis.from_url(url, **kwargs)
+    return _redis
+
 def send_email(to, subject, content):
     message = Mail(
         from_email='admin@asfour.com',
@@ -50,20 +71,95 @@ def update_status(current_task, current_stage, display_message):
         }
     )
 
+# Rows fetched per round trip from the export's server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
 def export_contacts(queryset):
-    rows = [[
+    """
+    Yields the contact export's rows, tag names aggregated in the 
+    database and contacts read in chunks from a server-side cursor
+    """
+    yield [
         'First Name',
         'Last Name',
         'Email',
         'Phone',
         'Tags',
-    ],]
-    for i in queryset:
-        rows.append([
-            i.first_name,
-            i.last_name,
-            i.email,
-            i.phone,
-            ', '.join([tag.name for tag in i.tags.all()]),
-        ])
-    return rows
\ No newline at end of file
+    ]
+    rows = queryset.prefetch_related(None).annotate(
+        tag_names=StringAgg('tags__name', ', ', default='')
+    ).order_by('first_name', 'id').values_list(
+        'first_name',
+        'last_name',
+        'email',
+        'phone',
+        'tag_names',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield row
+
+def export_responses(queryset):
+    """
+    Yields the response export's rows from one joined query, 
+    read in chunks from a server-side cursor
+    """
+    yield [
+        'phone',
+        'first_name',
+        'last_name',
+        'tags',
+        'response',
+        'method',
+        'recording',
+        'timestamp',
+        'last_message_received',
+    ]
+    rows = queryset.select_related(None).annotate(
+        tag_names=StringAgg('contact__tags__name', '; ', default='')
+    ).order_by('-timestamp', '-id').values_list(
+        'phone',
+        'contact__first_name',
+        'contact__last_name',
+        'tag_names',
+        'body',
+        'method',
+        'recording',
+        'timestamp',
+        'message__body',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    methods = dict(queryset.model.MEDIUM_CHOICES)
+    for row in rows:
+        row = list(row)
+        row[5] = methods.get(row[5], row[5])
+        yield row
+
+def export_message_logs(queryset):
+    """
+    Yields the send log export's rows from one joined query, 
+    read in chunks from a server-side cursor
+    """
+    yield [
+        'message',
+        'first_name',
+        'last_name',
+        'phone',
+        'status',
+        'twilio_status',
+        'error',
+        'timestamp',
+    ]
+    rows = queryset.select_related(None).annotate(
+        msg_text=Coalesce(NullIf('text',
+            Value('', output_field=TextField())), 'message__body')
+    ).order_by('-timestamp', '-id').values_list(
+        'msg_text',
+        'contact__first_name',
+        'contact__last_name',
+        'contact__phone',
+        'status',
+        'twilio_status',
+        'error',
+        'timestamp',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        yield row
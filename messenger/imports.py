@@ -0,0 +1,292 @@
+import codecs
+import csv
+import re
+
+from collections import defaultdict
+from functools import partial
+
+from django.apps import apps
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import membership
+
+# Rows upserted per transaction
+BATCH_SIZE = 1000
+# Row errors kept on the job; any beyond this are only counted
+MAX_ERRORS = 500
+CONTACT_FIELDS = ('first_name', 'last_name', 'email')
+TAG_COLUMNS = ('tag1', 'tag2', 'tag3')
+# Row errors and tag names listed in a preview, and contact 
+# phones per fetch
+MAX_PREVIEW_ITEMS = 20
+PREVIEW_CHUNK_SIZE = 10000
+
+def normalize_phone(raw, add_country_code=False):
+    """
+    Returns the phone as Contact.save() would store it, or None
+    if it has no digits
+    """
+    digits = re.sub('[^0-9]', '', raw or '')
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '1' and not add_country_code:
+        return '+' + digits
+    return '+1' + digits
+
+def count_rows(upload):
+    """Counts an upload's data lines and rewinds it"""
+    lines = sum(1 for _ in upload)
+    upload.seek(0)
+    return max(lines - 1, 0)
+
+def get_fields(reader):
+    """
+    The contact fields the file has columns for; missing columns 
+    leave existing values alone
+    """
+    return [field for field in CONTACT_FIELDS
+        if field in (reader.fieldnames or ())]
+
+def parse_row(row, fields, add_country_code=False):
+    """
+    Returns a row's phone, contact values and tag names, raising 
+    ValueError if it can't be imported
+    """
+    Contact = apps.get_model(app_label='messenger',
+        model_name='Contact')
+    phone = normalize_phone(row.get('phone'), add_country_code)
+    if phone is None:
+        raise ValueError('Missing phone number')
+    values = {field: (row.get(field) or '').strip()
+        for field in fields}
+    tags = {(row.get(column) or '').strip()
+        for column in TAG_COLUMNS} - {''}
+    too_long = [field for field, value in values.items()
+        if len(value) > Contact._meta.get_field(field).max_length]
+    too_long += ['tag' for tag in tags if len(tag) > 255]
+    if too_long:
+        raise ValueError('{} is too long'.format(too_long[0]))
+    return phone, values, tags
+
+def parse_batch(batch, fields, add_country_code, add_error):
+    """
+    Validates a batch of (index, row) pairs, passing bad rows to 
+    add_error. Where a phone repeats, the last row's values win and 
+    the tags of every row are added.
+    """
+    records = {}
+    for index, row in batch:
+        try:
+            phone, values, tags = parse_row(row, fields, 
+                add_country_code)
+        except ValueError as error:
+            add_error(index, error)
+            continue
+        if phone in records:
+            tags |= records[phone][2]
+        records[phone] = (index, values, tags)
+    return records
+
+def preview_import(upload, org_id, add_country_code=False):
+    """
+    Works out what importing the upload would change by diffing 
+    its phones and tags against the organization's, writing nothing
+    """
+    Contact = apps.get_model(app_label='messenger',
+        model_name='Contact')
+    Tag = apps.get_model(app_label='messenger', model_name='Tag')
+    reader = csv.DictReader(codecs.iterdecode(upload, 'utf-8-sig'))
+    fields = get_fields(reader)
+    phones, tags, errors = set(), set(), []
+    rows = invalid = 0
+
+    def add_error(index, error):
+        nonlocal invalid
+        invalid += 1
+        if len(errors) < MAX_PREVIEW_ITEMS:
+            errors.append('Row {0}: {1}'.format(index, error))
+
+    def add_batch(batch):
+        # Parsed as the importer will, so the tags agree
+        records = parse_batch(batch, fields, add_country_code, 
+            add_error)
+        phones.update(records)
+        for index, values, row_tags in records.values():
+            tags.update(row_tags)
+
+    batch = []
+    for index, row in enumerate(reader, start=1):
+        rows += 1
+        batch.append((index, row))
+        if len(batch) == BATCH_SIZE:
+            add_batch(batch)
+            batch = []
+    add_batch(batch)
+    upload.seek(0)
+    existing = set(Contact.objects.filter(organization_id=org_id) \
+        .values_list('phone', flat=True).iterator(
+            chunk_size=PREVIEW_CHUNK_SIZE))
+    new_tags = tags - set(Tag.objects.filter(
+        organization_id=org_id).values_list('name', flat=True))
+    return {
+        'rows': rows,
+        'invalid': invalid,
+        'duplicates': rows - invalid - len(phones),
+        'new_contacts': len(phones - existing),
+        'updated_contacts': len(phones & existing),
+        'new_tag_count': len(new_tags),
+        'new_tags': sorted(new_tags)[:MAX_PREVIEW_ITEMS],
+        'errors': errors,
+    }
+
+class ContactImporter:
+    """
+    Streams a job's CSV and upserts its contacts and tag links
+    a batch at a time, recording progress and row errors on the job
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.org_id = job.organization_id
+        self.tag_ids = {}
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self):
+        with self.job.file.open('rb') as upload:
+            reader = csv.DictReader(codecs.iterdecode(upload,
+                'utf-8-sig'))
+            self.fields = get_fields(reader)
+            batch = []
+            for index, row in enumerate(reader, start=1):
+                batch.append((index, row))
+                if len(batch) == BATCH_SIZE:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+
+    def add_error(self, index, error):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            if index is not None:
+                error = 'Row {0}: {1}'.format(index, error)
+            self.errors.append(str(error))
+
+    def parse(self, batch):
+        return parse_batch(batch, self.fields, 
+            self.job.add_country_code, self.add_error)
+
+    def load_tags(self, names):
+        """Looks up, or creates, the ids of any tags not yet seen"""
+        Tag = apps.get_model(app_label='messenger',
+            model_name='Tag')
+        missing = set(names) - set(self.tag_ids)
+        if not missing:
+            return
+        self.tag_ids.update(Tag.objects.filter(
+            organization_id=self.org_id, name__in=missing
+        ).order_by('-id').values_list('name', 'id'))
+        created = Tag.objects.bulk_create([
+            Tag(organization_id=self.org_id, name=name)
+            for name in missing - set(self.tag_ids)
+        ])
+        self.tag_ids.update((tag.name, tag.id) for tag in created)
+
+    def save(self, records):
+        """Upserts the records' contacts and adds their tags"""
+        Contact = apps.get_model(app_label='messenger',
+            model_name='Contact')
+        Through = Contact.tags.through
+        # Where a phone has duplicates, the oldest contact wins
+        contact_ids = dict(Contact.objects.filter(
+            organization_id=self.org_id, phone__in=list(records)
+        ).order_by('-id').values_list('phone', 'id'))
+        new, changed = [], []
+        for phone, (index, values, tags) in records.items():
+            if phone in contact_ids:
+                changed.append(Contact(id=contact_ids[phone],
+                    **values))
+            else:
+                new.append(Contact(organization_id=self.org_id,
+                    phone=phone, **values))
+        Contact.objects.bulk_create(new)
+        contact_ids.update((contact.phone, contact.id)
+            for contact in new)
+        if changed and self.fields:
+            Contact.objects.bulk_update(changed, self.fields)
+        members = defaultdict(list)
+        for phone, (index, values, tags) in records.items():
+            for name in tags:
+                members[self.tag_ids[name]].append(contact_ids[phone])
+        Through.objects.bulk_create([
+            Through(contact_id=contact_id, tag_id=tag_id)
+            for tag_id, ids in members.items() for contact_id in ids
+        ], ignore_conflicts=True)
+        transaction.on_commit(partial(self.add_members, members))
+        return len(new), len(changed)
+
+    def add_members(self, members):
+        """Mirrors committed tag links into the membership index"""
+        for tag_id, contact_ids in members.items():
+            membership.add_members(self.org_id, [tag_id], contact_ids)
+
+    def import_batch(self, batch):
+        records = self.parse(batch)
+        self.load_tags(set().union(*(tags
+            for index, values, tags in records.values())))
+        try:
+            with transaction.atomic():
+                created, updated = self.save(records)
+        except DatabaseError:
+            # Retry the rows one at a time to find the bad ones
+            created, updated = 0, 0
+            for phone, record in records.items():
+                try:
+                    with transaction.atomic():
+                        counts = self.save({phone: record})
+                except DatabaseError as error:
+                    self.add_error(record[0], error)
+                else:
+                    created += counts[0]
+                    updated += counts[1]
+        self.created += created
+        self.updated += updated
+        self.processed += len(batch)
+        self.report()
+
+    def report(self, **kwargs):
+        ContactImportJob = apps.get_model(app_label='messenger',
+            model_name='ContactImportJob')
+        ContactImportJob.objects.filter(id=self.job.id).update(
+            processed_rows=self.processed,
+            created_count=self.created,
+            updated_count=self.updated,
+            error_count=self.error_count,
+            errors='\n'.join(self.errors),
+            **kwargs
+        )
+
+def run_import(job):
+    """Runs an import job, marking it finished or failed"""
+    job.status = job.RUNNING
+    job.save(update_fields=['status'])
+    importer = ContactImporter(job)
+    try:
+        importer.run()
+    except (UnicodeDecodeError, csv.Error) as error:
+        importer.add_error(None, 'Failed to read file. Please make '
+            'sure the file is a UTF-8 CSV ({})'.format(error))
+        importer.report(status=job.FAILED,
+            date_finished=timezone.now())
+        return 'failed'
+    except Exception:
+        importer.report(status=job.FAILED,
+            date_finished=timezone.now())
+        raise
+    importer.report(status=job.FINISHED, date_finished=timezone.now())
+    return 'done'
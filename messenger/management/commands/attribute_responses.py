@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min, OuterRef, Subquery
+
+from messenger.models import MessageLog, Response
+
+
+class Command(BaseCommand):
+    help = (
+        'Links existing responses to the last message sent to their '
+        'contact before they arrived'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+            help='Responses updated per UPDATE statement')
+        parser.add_argument('--organization', type=int,
+            help='Only backfill this organization\'s responses')
+
+    def handle(self, *args, **options):
+        responses = Response.objects.filter(
+            message__isnull=True, contact__isnull=False)
+        if options['organization']:
+            responses = responses.filter(
+                organization_id=options['organization'])
+        latest = MessageLog.objects.filter(
+            contact_id=OuterRef('contact_id'),
+            message__isnull=False,
+            status=MessageLog.SUCCESS,
+            timestamp__lte=OuterRef('timestamp'),
+        ).order_by('-timestamp').values('message_id')[:1]
+        bounds = responses.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write('No responses to backfill')
+            return
+        size = options['batch_size']
+        updated = 0
+        for start in range(bounds['low'], bounds['high'] + 1, size):
+            updated += responses.filter(
+                id__gte=start, id__lt=start + size,
+            ).update(message_id=Subquery(latest))
+        unmatched = responses.filter(id__lte=bounds['high']).count()
+        self.stdout.write('Linked {0} of {1} responses'.format(
+            updated - unmatched, updated))
@@ -0,0 +1,312 @@
+import base64
+import datetime
+import json
+import random
+import re
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse, request as urllib_request
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+
+from twilio.request_validator import RequestValidator
+
+ACCOUNT_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<sid>\w+)/(?P<rest>.+)$')
+CONFERENCE_PATH = re.compile(r'^Conferences/(?P<name>[^/]+)/Participants\.json$')
+USAGE_PRICE = 0.0079
+
+
+class Simulator:
+    """
+    Stand-in for the parts of the Twilio REST API the app uses, 
+    with configurable latency, 429/5xx injection and signed 
+    status callbacks
+    """
+
+    def __init__(self, options, stdout):
+        self.options = options
+        self.stdout = stdout
+        self.stats = Counter()
+        self.usage = Counter()
+        self.lock = threading.Lock()
+        self.callbacks = ThreadPoolExecutor(
+            max_workers=options['callback_workers'])
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def wait(self):
+        latency = self.options['latency'] + random.uniform(
+            -self.options['jitter'], self.options['jitter'])
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def get_fault(self):
+        """Returns an injected (status, body) error, or None"""
+        roll = random.random()
+        if roll < self.options['rate_limit_rate']:
+            return 429, {'code': 20429, 'status': 429,
+                'message': 'Too Many Requests'}
+        if roll < self.options['rate_limit_rate'] + \
+            self.options['error_rate']:
+            status = random.choice((500, 503))
+            return status, {'code': 20500, 'status': status,
+                'message': 'Internal Server Error'}
+        return None
+
+    def create_message(self, account_sid, token, params):
+        sid = 'SM' + uuid4().hex
+        with self.lock:
+            self.usage[account_sid, 'sms-outbound'] += 1
+        self.schedule_callbacks(token, params.get('StatusCallback'), {
+            'AccountSid': account_sid,
+            'MessageSid': sid,
+            'SmsSid': sid,
+            'From': params.get('From', ''),
+            'To': params.get('To', ''),
+        }, 'MessageStatus', self.get_message_statuses())
+        return 201, self.get_resource(account_sid, sid, params, 
+            status='queued', body=params.get('Body', ''),
+            num_segments='1', direction='outbound-api')
+
+    def create_call(self, account_sid, token, params):
+        sid = 'CA' + uuid4().hex
+        self.schedule_callbacks(token, params.get('StatusCallback'), {
+            'AccountSid': account_sid,
+            'CallSid': sid,
+            'From': params.get('From', ''),
+            'To': params.get('To', ''),
+        }, 'CallStatus', [('completed', None)])
+        return 201, self.get_resource(account_sid, sid, params, 
+            status='queued', direction='outbound-api')
+
+    def create_participant(self, account_sid, token, name, params):
+        call_sid = 'CA' + uuid4().hex
+        return 201, {
+            'account_sid': account_sid,
+            'call_sid': call_sid,
+            'conference_sid': 'CF' + uuid4().hex,
+            'label': name,
+            'status': 'queued',
+            'muted': False,
+            'hold': False,
+            'date_created': self.get_date(),
+            'uri': '/2010-04-01/Accounts/{0}/Conferences/{1}/'
+                'Participants/{2}.json'.format(
+                account_sid, name, call_sid),
+        }
+
+    def list_usage(self, account_sid, query):
+        category = query.get('Category', [''])[0]
+        with self.lock:
+            outbound = self.usage[account_sid, 'sms-outbound']
+            counts = {
+                'sms-outbound': outbound,
+                'sms-inbound': self.usage[account_sid, 'sms-inbound'],
+                'totalprice': outbound,
+            }
+        records = []
+        if category in counts:
+            records.append({
+                'account_sid': account_sid,
+                'category': category,
+                'count': str(counts[category]),
+                'price': '{:.4f}'.format(outbound * USAGE_PRICE),
+                'price_unit': 'usd',
+                'start_date': query.get('StartDate', [''])[0],
+                'end_date': query.get('EndDate', [''])[0],
+            })
+        return 200, {
+            'usage_records': records,
+            'first_page_uri': None,
+            'next_page_uri': None,
+            'previous_page_uri': None,
+            'page': 0,
+            'page_size': 50,
+            'uri': '/2010-04-01/Accounts/{}/Usage/Records.json'.format(
+                account_sid),
+        }
+
+    def get_message_statuses(self):
+        if random.random() < self.options['undelivered_rate']:
+            return [('sent', None), ('undelivered', '30003')]
+        return [('sent', None), ('delivered', None)]
+
+    def get_resource(self, account_sid, sid, params, **kwargs):
+        resource = {
+            'sid': sid,
+            'account_sid': account_sid,
+            'to': params.get('To', ''),
+            'from': params.get('From', ''),
+            'date_created': self.get_date(),
+            'date_updated': self.get_date(),
+            'error_code': None,
+            'error_message': None,
+            'price': None,
+            'uri': '/2010-04-01/Accounts/{0}/{1}.json'.format(
+                account_sid, sid),
+        }
+        resource.update(kwargs)
+        return resource
+
+    def get_date(self):
+        return datetime.datetime.utcnow().strftime(
+            '%a, %d %b %Y %H:%M:%S +0000')
+
+    def schedule_callbacks(self, token, url, params, status_field, 
+        statuses):
+        if not url:
+            return
+        self.callbacks.submit(self.send_callbacks, token, url, 
+            params, status_field, statuses)
+
+    def send_callbacks(self, token, url, params, status_field, 
+        statuses):
+        validator = RequestValidator(token)
+        for status, error_code in statuses:
+            time.sleep(self.options['callback_delay'])
+            data = dict(params)
+            data[status_field] = status
+            if status_field == 'MessageStatus':
+                data['SmsStatus'] = status
+            if error_code:
+                data['ErrorCode'] = error_code
+            signature = validator.compute_signature(url, data)
+            callback = urllib_request.Request(url, 
+                data=parse.urlencode(data).encode(),
+                headers={'X-Twilio-Signature': signature})
+            try:
+                with urllib_request.urlopen(callback, timeout=10) as resp:
+                    self.count('callbacks_{}'.format(resp.status))
+            except Exception as error:
+                self.count('callbacks_failed')
+                self.stdout.write('Callback to {0} failed: {1}'.format(
+                    url, error))
+
+    def handle(self, method, path, headers, body):
+        """Returns the (status, payload) for one API request"""
+        self.count('requests')
+        credentials = self.get_credentials(headers)
+        if not credentials:
+            return 401, {'code': 20003, 'status': 401,
+                'message': 'Authenticate'}
+        url = parse.urlsplit(path)
+        match = ACCOUNT_PATH.match(url.path)
+        if not match or match.group('sid') != credentials[0]:
+            return 404, {'code': 20404, 'status': 404,
+                'message': 'The requested resource was not found'}
+        self.wait()
+        fault = self.get_fault()
+        if fault:
+            self.count('status_{}'.format(fault[0]))
+            return fault
+        account_sid, token = credentials
+        rest = match.group('rest')
+        params = {key: value[-1] for key, value 
+            in parse.parse_qs(body).items()}
+        if method == 'POST' and rest == 'Messages.json':
+            result = self.create_message(account_sid, token, params)
+        elif method == 'POST' and rest == 'Calls.json':
+            result = self.create_call(account_sid, token, params)
+        elif method == 'POST' and CONFERENCE_PATH.match(rest):
+            name = parse.unquote(CONFERENCE_PATH.match(rest).group('name'))
+            result = self.create_participant(account_sid, token, 
+                name, params)
+        elif method == 'GET' and rest == 'Usage/Records.json':
+            result = self.list_usage(account_sid, 
+                parse.parse_qs(url.query))
+        else:
+            result = 404, {'code': 20404, 'status': 404,
+                'message': 'The requested resource was not found'}
+        self.count('status_{}'.format(result[0]))
+        return result
+
+    def get_credentials(self, headers):
+        auth = headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            return None
+        try:
+            decoded = base64.b64decode(auth[6:]).decode()
+        except ValueError:
+            return None
+        account_sid, _, token = decoded.partition(':')
+        return account_sid, token
+
+
+def get_handler(simulator):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.respond('GET')
+
+        def do_POST(self):
+            self.respond('POST')
+
+        def respond(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode() if length else ''
+            status, payload = simulator.handle(
+                method, self.path, self.headers, body)
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            if simulator.options['verbosity'] > 1:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a local stand-in for the Twilio Messages, Calls, Usage '
+        'and Conferences endpoints. Point TWILIO_API_BASE_URL at it, '
+        'and SITE_URL at this app so status callbacks come back here. '
+        'Callbacks are signed with the request\'s auth token, which is '
+        'the organization\'s twilio_secret.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=100,
+            help='Mean response latency in milliseconds')
+        parser.add_argument('--jitter', type=float, default=50,
+            help='Maximum deviation from the mean latency in ms')
+        parser.add_argument('--rate-limit-rate', type=float, 
+            default=0, help='Fraction of requests answered with 429')
+        parser.add_argument('--error-rate', type=float, default=0,
+            help='Fraction of requests answered with 500 or 503')
+        parser.add_argument('--undelivered-rate', type=float, 
+            default=0, help='Fraction of messages that end undelivered')
+        parser.add_argument('--callback-delay', type=float, default=1,
+            help='Seconds between successive status callbacks')
+        parser.add_argument('--callback-workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        simulator = Simulator(options, self.stdout)
+        server = ThreadingHTTPServer(
+            (options['host'], options['port']), get_handler(simulator))
+        self.stdout.write('Twilio simulator listening on '
+            'http://{host}:{port}'.format(**options))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            simulator.callbacks.shutdown(wait=False)
+            for key, value in sorted(simulator.stats.items()):
+                self.stdout.write('{0}: {1}'.format(key, value))
@@ -0,0 +1,119 @@
+from uuid import uuid4
+
+from django.apps import apps
+from django.db.models import Count
+
+from .functions import get_redis
+
+# Rebuilt from the database once a day to heal any drift
+INDEX_TTL = 60 * 60 * 24
+BUILD_CHUNK_SIZE = 10000
+
+def get_tag_key(org_id, tag_id):
+    return 'tags:{0}:{1}'.format(org_id, tag_id)
+
+def get_built_key(org_id):
+    return 'tags:{}:built'.format(org_id)
+
+def build_index(org_id):
+    """Loads the organization's tag memberships from the database"""
+    Tag = apps.get_model(app_label='messenger', model_name='Tag')
+    Contact = apps.get_model(app_label='messenger', 
+        model_name='Contact')
+    conn = get_redis()
+    tag_ids = Tag.objects.filter(organization_id=org_id) \
+        .values_list('id', flat=True)
+    conn.delete(get_built_key(org_id), 
+        *[get_tag_key(org_id, tag_id) for tag_id in tag_ids])
+    memberships = Contact.tags.through.objects.filter(
+        tag__organization_id=org_id).values_list('tag_id', 
+        'contact_id').iterator(chunk_size=BUILD_CHUNK_SIZE)
+    pipe = conn.pipeline(transaction=False)
+    for index, (tag_id, contact_id) in enumerate(memberships, 1):
+        pipe.sadd(get_tag_key(org_id, tag_id), contact_id)
+        if index % BUILD_CHUNK_SIZE == 0:
+            pipe.execute()
+    pipe.set(get_built_key(org_id), 1, ex=INDEX_TTL)
+    pipe.execute()
+
+def get_index(org_id):
+    """Returns a Redis connection with the org's index loaded"""
+    conn = get_redis()
+    if conn is not None and not conn.exists(get_built_key(org_id)):
+        build_index(org_id)
+    return conn
+
+def add_members(org_id, tag_ids, contact_ids):
+    update_members(org_id, tag_ids, contact_ids, 'sadd')
+
+def remove_members(org_id, tag_ids, contact_ids):
+    update_members(org_id, tag_ids, contact_ids, 'srem')
+
+def update_members(org_id, tag_ids, contact_ids, command):
+    """
+    Applies a membership change to a built index. Unbuilt 
+    indexes are left alone and load from the database when read.
+    """
+    conn = get_redis()
+    if conn is None or not tag_ids or not contact_ids:
+        return
+    if not conn.exists(get_built_key(org_id)):
+        return
+    pipe = conn.pipeline(transaction=False)
+    for tag_id in tag_ids:
+        getattr(pipe, command)(get_tag_key(org_id, tag_id), 
+            *contact_ids)
+    pipe.execute()
+
+def forget_tag(org_id, tag_id):
+    conn = get_redis()
+    if conn is not None:
+        conn.delete(get_tag_key(org_id, tag_id))
+
+def get_tag_counts(org_id, tag_ids):
+    """Returns {tag_id: number of contacts} for the tags"""
+    tag_ids = list(tag_ids)
+    conn = get_index(org_id)
+    if conn is None:
+        Tag = apps.get_model(app_label='messenger', model_name='Tag')
+        return dict(Tag.objects.filter(id__in=tag_ids).annotate(
+            count=Count('contact')).values_list('id', 'count'))
+    pipe = conn.pipeline(transaction=False)
+    for tag_id in tag_ids:
+        pipe.scard(get_tag_key(org_id, tag_id))
+    return dict(zip(tag_ids, pipe.execute()))
+
+def count_members(org_id, union=(), intersect=(), exclude=()):
+    """
+    Counts contacts with any of the union tags, that also have 
+    every intersect tag and none of the exclude tags
+    """
+    if not union:
+        return 0
+    conn = get_index(org_id)
+    if conn is None:
+        return count_members_in_db(org_id, union, intersect, exclude)
+    key = 'tags:{0}:tmp:{1}'.format(org_id, uuid4().hex)
+    pipe = conn.pipeline()
+    pipe.sunionstore(key, [get_tag_key(org_id, tag_id) 
+        for tag_id in union])
+    if intersect:
+        pipe.sinterstore(key, [key] + [get_tag_key(org_id, tag_id) 
+            for tag_id in intersect])
+    if exclude:
+        pipe.sdiffstore(key, [key] + [get_tag_key(org_id, tag_id) 
+            for tag_id in exclude])
+    pipe.scard(key)
+    pipe.delete(key)
+    return pipe.execute()[-2]
+
+def count_members_in_db(org_id, union, intersect, exclude):
+    Contact = apps.get_model(app_label='messenger', 
+        model_name='Contact')
+    contacts = Contact.objects.filter(organization_id=org_id, 
+        tags__in=union)
+    for tag_id in intersect:
+        contacts = contacts.filter(tags=tag_id)
+    if exclude:
+        contacts = contacts.exclude(tags__in=exclude)
+    return contacts.distinct().count()
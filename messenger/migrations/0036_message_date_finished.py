@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0035_organization_date_added_tag_date_added_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='date_finished',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
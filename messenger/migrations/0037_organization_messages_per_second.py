@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0036_message_date_finished'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='messages_per_second',
+            field=models.PositiveIntegerField(default=1, help_text='Outbound Twilio requests allowed per second for each sender number'),
+        ),
+    ]
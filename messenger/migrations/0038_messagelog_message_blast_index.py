@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0037_organization_messages_per_second'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messagelog',
+            index=models.Index(fields=['message', 'async_task_id', 'contact'], name='messenger_m_message_24f6e5_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0038_messagelog_message_blast_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='delivery_window',
+            field=models.PositiveIntegerField(blank=True, help_text='Minutes to spread delivery across', null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='send_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0039_message_delivery_window_message_send_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoreply',
+            name='match_prefix',
+            field=models.BooleanField(default=False, help_text='Also reply to messages that start with this text'),
+        ),
+    ]
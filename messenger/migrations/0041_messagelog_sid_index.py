@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0040_autoreply_match_prefix'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messagelog',
+            name='sid',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
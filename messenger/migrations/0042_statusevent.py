@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0041_messagelog_sid_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sid', models.CharField(max_length=64)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Accepted'), (2, 'Scheduled'), (3, 'Queued'), (4, 'Sending'), (5, 'Sent'), (6, 'Delivered'), (7, 'Undelivered'), (8, 'Failed'), (9, 'Read'), (10, 'Canceled')])),
+                ('error_code', models.PositiveIntegerField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='messenger.message')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+                'indexes': [models.Index(fields=['message', 'status', 'timestamp'], name='messenger_s_message_3cb36c_idx'), models.Index(fields=['sid', 'timestamp'], name='messenger_s_sid_d53a80_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0042_statusevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='messenger.message'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['message', '-timestamp'], name='messenger_r_message_953abd_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:55
+
+import asfour.storage_backends
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0043_response_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(storage=asfour.storage_backends.PrivateMediaStorage(), upload_to='imports/')),
+                ('add_country_code', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('processed_rows', models.PositiveIntegerField(default=0)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('updated_count', models.PositiveIntegerField(default=0)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('errors', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='messenger.userprofile')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='messenger.organization')),
+            ],
+            options={
+                'ordering': ('-date_created',),
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0044_contactimportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactimportjob',
+            name='preview',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='contactimportjob',
+            name='status',
+            field=models.CharField(choices=[('preview', 'Preview'), ('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:58
+
+import asfour.storage_backends
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0045_contactimportjob_preview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(blank=True, max_length=255)),
+                ('kind', models.CharField(choices=[('contacts', 'Contacts'), ('responses', 'Responses'), ('message_logs', 'Send Log')], max_length=20)),
+                ('file', models.FileField(blank=True, storage=asfour.storage_backends.PrivateMediaStorage(), upload_to='exports/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='messenger.userprofile')),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='messenger.message')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='messenger.organization')),
+            ],
+            options={
+                'ordering': ('-date_created',),
+            },
+        ),
+    ]
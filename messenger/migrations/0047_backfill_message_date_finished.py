@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_date_finished(apps, schema_editor):
+    # Messages sent before date_finished existed are already done
+    Message = apps.get_model('messenger', 'Message')
+    Message.objects.filter(date_sent__isnull=False,
+        date_finished__isnull=True).update(date_finished=F('date_sent'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0046_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_date_finished,
+            migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def raise_zero_rates(apps, schema_editor):
+    # A rate of zero divides by zero in the token bucket
+    Organization = apps.get_model('messenger', 'Organization')
+    Organization.objects.filter(messages_per_second=0).update(
+        messages_per_second=1)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0047_backfill_message_date_finished'),
+    ]
+
+    operations = [
+        migrations.RunPython(raise_zero_rates,
+            migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='organization',
+            name='messages_per_second',
+            field=models.PositiveIntegerField(default=1, help_text='Outbound Twilio requests allowed per second for each sender number', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
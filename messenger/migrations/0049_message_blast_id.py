@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0048_organization_messages_per_second_min'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='blast_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
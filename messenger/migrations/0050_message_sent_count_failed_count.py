@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_logs(MessageLog, status):
+    return Coalesce(Subquery(MessageLog.objects.filter(
+        message=OuterRef('pk'), status=status,
+    ).order_by().values('message').annotate(
+        total=Count('id')).values('total')), 0)
+
+
+def backfill_counts(apps, schema_editor):
+    # Totals for messages sent before they were stored
+    Message = apps.get_model('messenger', 'Message')
+    MessageLog = apps.get_model('messenger', 'MessageLog')
+    Message.objects.filter(date_finished__isnull=False).update(
+        sent_count=count_logs(MessageLog, 'success'),
+        failed_count=count_logs(MessageLog, 'failed'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0049_message_blast_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sent_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts,
+            migrations.RunPython.noop),
+    ]
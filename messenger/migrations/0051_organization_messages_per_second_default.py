@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:22
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def raise_default_rates(apps, schema_editor):
+    # Organizations left at the old default of 1 go to the 3 per 
+    # second the delivery window estimate assumed before the limit
+    Organization = apps.get_model('messenger', 'Organization')
+    Organization.objects.filter(messages_per_second=1).update(
+        messages_per_second=3)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0050_message_sent_count_failed_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(raise_default_rates,
+            migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='organization',
+            name='messages_per_second',
+            field=models.PositiveIntegerField(default=3, help_text='Outbound Twilio requests allowed per second for each sender number', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
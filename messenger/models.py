@@ -1,19 +1,28 @@
 import datetime
 import re
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import connection, models
+from django.db.models import Count, Min, Q
 from django.urls import reverse
+from django.utils import timezone
 from uuid import uuid4
 
 from asfour.storage_backends import PrivateMediaStorage
 from asfour.storage_backends import PublicMediaStorage
 
-from twilio.rest import Client
 from twilio.twiml.voice_response import VoiceResponse, Dial
 
+from . import autoreplies, membership
+from .cache import forget_organization
+from .clients import forget_client, get_client
 from .functions import send_email
-from .tasks import task_send_email, send_messages
+from .progress import start_batches, start_progress
+from .ratelimit import throttled_create
+from .tasks import (task_send_email, cancel_schedule, 
+    release_batches, schedule_batches)
 
 class Organization(models.Model):
 
@@ -32,24 +41,41 @@ class Organization(models.Model):
         max_length=255, blank=True)
     date_added = models.DateField(auto_now_add=True)
     url = models.URLField(max_length=255, blank=True)
+    messages_per_second = models.PositiveIntegerField(default=3,
+        validators=[MinValueValidator(1)], help_text='Outbound Twilio requests allowed per second '
+        'for each sender number')
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Organization, self).save(*args, **kwargs)
+        forget_client(self.id)
+        forget_organization(self.id)
+
+    def delete(self, *args, **kwargs):
+        pk = self.id
+        result = super(Organization, self).delete(*args, **kwargs)
+        forget_client(pk)
+        forget_organization(pk)
+        return result
+
     def get_credentials(self):
         return self.twilio_api_key, \
             self.twilio_secret, self.phone
 
-    def get_reply_msg(self, response):
-        for reply in self.autoreply_set.all():
-            if response.body.lower().strip() == reply.text.lower():
-                reply.add_tags(response.contact)
-                return reply.reply
-        if response.contact:
-            if not response.contact.has_email:
-                return "Thank you for subscribing. Please reply with your email address or STOP to unsubscribe"
-        return self.response_msg
-    
+    def get_client(self):
+        return get_client(self)
+
+    def get_reply(self, body, has_email=True):
+        """Returns the reply text and the tag ids to apply"""
+        match = autoreplies.match(self.id, body)
+        if match:
+            return match
+        if not has_email:
+            return "Thank you for subscribing. Please reply with your email address or STOP to unsubscribe", []
+        return self.response_msg, []
+
     def transfer(self):
         btb = Organization.objects.get(id=4)
         wrong_list = Tag.objects.get(id=279)
@@ -115,9 +141,7 @@ class Invoice(models.Model):
             start_date = self.date
         if not end_date:
             end_date = datetime.date.today()
-        account_sid, auth_token, phone = self.organization \
-        .get_credentials()
-        client = Client(account_sid, auth_token)
+        client = self.organization.get_client()
         # usage_records = client.usage.records.list(
         #     start_date=self.date,
         #     end_date=datetime.date.today()
@@ -257,16 +281,15 @@ class Contact(models.Model):
     #         super(Contact, self).save(*args, **kwargs)
 
     def send_sms(self, body):
-        account_sid, auth_token, phone = self.organization \
-        .get_credentials()
-        client = Client(account_sid, auth_token)
+        phone = self.organization.phone
+        client = self.organization.get_client()
         try:
-            msg = client.messages.create(
+            msg = throttled_create(client.messages, self.organization,
                 to=self.phone,
                 from_=phone,
                 body=body,
                 status_callback='{}{}'.format(
-                    'https://www.3asfour.com',
+                    settings.SITE_URL,
                     reverse('status-callback', kwargs={
                         'pk':self.organization.id
                     }),
@@ -286,6 +309,22 @@ class Contact(models.Model):
         )
         return True
 
+    def add_tags(self, tag_ids):
+        """
+        Adds the tags in one bulk insert into Contact.tags, skipping 
+        any deleted since their ids were looked up
+        """
+        tag_ids = list(Tag.objects.filter(id__in=list(tag_ids), 
+            organization_id=self.organization_id
+        ).values_list('id', flat=True))
+        Through = Contact.tags.through
+        Through.objects.bulk_create([
+            Through(contact_id=self.id, tag_id=tag_id) 
+            for tag_id in tag_ids
+        ], ignore_conflicts=True)
+        membership.add_members(self.organization_id, tag_ids, 
+            [self.id])
+
     def get_absolute_url(self):
         return reverse('contact-detail', 
             kwargs={'pk':self.id})
@@ -355,6 +394,15 @@ class Message(models.Model):
         on_delete=models.SET_NULL, blank=True, null=True)
     date_created = models.DateField(auto_now_add=True)
     date_sent = models.DateTimeField(blank=True, null=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+    # The latest send's blast; only it may mark the message finished
+    blast_id = models.CharField(max_length=32, blank=True)
+    # The last finished blast's totals, outliving its progress counters
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    send_at = models.DateTimeField(blank=True, null=True)
+    delivery_window = models.PositiveIntegerField(blank=True, 
+        null=True, help_text='Minutes to spread delivery across')
 
     class Meta:
         ordering = ('-id',)
@@ -380,25 +428,68 @@ class Message(models.Model):
         return None
 
     def send(self, request=None):
-        kwargs = {'msg_id': self.id,}
-        print('sending msg')
-        # if request:
-        #     if hasattr(request.user, 'userprofile'):
-        #         kwargs['user_profile'] = \
-        #         request.user.userprofile
+        kwargs = {'msg_id': self.id, 'blast_id': uuid4().hex}
         if self.method == 'voice':
-            print('sending voice msg')
             kwargs['voice_uri'] = self.get_voice_uri(request)
-        send_messages.delay(**kwargs)
-        # self.log_message(contact, request, error)
-        self.date_sent = datetime.datetime.now()
+        batches = self.get_batches()
+        cancel_schedule(self.id)
+        self.date_sent = max(self.send_at or timezone.now(), 
+            timezone.now())
+        self.date_finished = None
+        self.blast_id = kwargs['blast_id']
         self.save()
+        start_progress(self.id, sum(len(batch) for batch in batches))
+        start_batches(kwargs['blast_id'], len(batches))
+        if self.is_scheduled():
+            schedule_batches(batches=batches, start=self.date_sent,
+                window=self.delivery_window, **kwargs)
+        else:
+            release_batches(batches=batches, **kwargs)
         return True
 
+    def is_scheduled(self):
+        if self.delivery_window:
+            return True
+        return bool(self.send_at and self.send_at > timezone.now())
+
+    def add_recipients(self, tags=None, everyone=False):
+        """
+        Adds every contact with any of the tags (or every contact 
+        in the organization) as a recipient, in a single 
+        INSERT ... SELECT into the contacts through table
+        """
+        contacts = Contact.objects.filter(
+            organization=self.organization)
+        if not everyone:
+            contacts = contacts.filter(tags__in=tags)
+        sql, params = contacts.order_by().values('id').distinct() \
+            .query.sql_with_params()
+        through = self.contacts.through._meta
+        quote = connection.ops.quote_name
+        insert = 'INSERT INTO {0} ({1}, {2}) SELECT %s, id ' \
+            'FROM ({3}) AS recipients WHERE true ' \
+            'ON CONFLICT DO NOTHING'.format(
+            quote(through.db_table),
+            quote(through.get_field('message').column),
+            quote(through.get_field('contact').column),
+            sql,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(insert, [self.id, *params])
+            return cursor.rowcount
+
+    def get_batches(self, size=None):
+        if not size:
+            size = settings.SEND_BATCH_SIZE
+        contact_ids = list(self.contacts.order_by('id')
+            .values_list('id', flat=True))
+        return [contact_ids[i:i + size] 
+            for i in range(0, len(contact_ids), size)]
+
     def get_kwargs(self, phone, voice_uri):
         kwargs = {
             'status_callback': '{}{}'.format(
-                'https://www.3asfour.com',
+                settings.SITE_URL,
                 reverse('status-callback', kwargs={
                     'pk':self.organization.id
                 }),
@@ -450,9 +541,48 @@ class Message(models.Model):
         return -(-chars // 160)
 
     def get_delivery_window(self):
+        if self.delivery_window:
+            return self.delivery_window
         segs = self.get_segments()
         contacts = self.contacts.count()
-        return round(segs * contacts / 180)
+        per_minute = self.organization.messages_per_second * 60
+        return round(segs * contacts / per_minute)
+
+    def get_delivery_funnel(self):
+        """Counts the recipients that reached each status"""
+        counts = StatusEvent.objects.filter(message=self) \
+            .values('status').annotate(count=Count('sid', 
+            distinct=True)).order_by('status')
+        labels = dict(StatusEvent.STATUS_CHOICES)
+        return {labels[row['status']]: row['count'] 
+            for row in counts}
+
+    def get_error_counts(self):
+        """Counts recipients by the error code Twilio reported"""
+        counts = StatusEvent.objects.filter(message=self, 
+            error_code__isnull=False).values('error_code') \
+            .annotate(count=Count('sid', distinct=True)) \
+            .order_by('-count')
+        return {row['error_code']: row['count'] for row in counts}
+
+    def get_delivery_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Seconds from a recipient's first reported status to 
+        delivery, at each of the given percentiles
+        """
+        times = StatusEvent.objects.filter(message=self) \
+            .values('sid').annotate(
+                start=Min('timestamp'),
+                delivered=Min('timestamp', filter=Q(
+                    status=StatusEvent.DELIVERED)),
+            ).filter(delivered__isnull=False) \
+            .values_list('start', 'delivered')
+        seconds = sorted((delivered - start).total_seconds() 
+            for start, delivered in times)
+        if not seconds:
+            return {}
+        return {pct: seconds[min(len(seconds) - 1, 
+            len(seconds) * pct // 100)] for pct in percentiles}
 
     def get_moderator(self):
         if self.created_by:
@@ -464,12 +594,12 @@ class Message(models.Model):
 
     def conference_call(self):
         response = VoiceResponse()
-        account_sid, auth_token, phone = \
-            self.organization.get_credentials()
-        client = Client(account_sid, auth_token)
-        call = client.calls.create(from_="client:"+phone, 
+        phone = self.organization.phone
+        client = self.organization.get_client()
+        call = throttled_create(client.calls, self.organization,
+            'calls', from_="client:"+phone, 
             to="client:"+self.get_moderator(),
-            url='https://www.3asfour.com/{}'.format(
+            url='{}/{}'.format(settings.SITE_URL,
                 reverse('conference-call', 
                     kwargs={'session_id':str(self.name)})
             ),
@@ -488,7 +618,9 @@ class Message(models.Model):
         # response.append(dial)
         
         for contact in self.contacts.all():
-            client.conferences(self.name).participants.create(
+            throttled_create(
+                client.conferences(self.name).participants,
+                self.organization, 'calls', 
                 from_=phone, to=contact.phone)
         return True
 
@@ -500,7 +632,8 @@ class MessageLog(models.Model):
         (SUCCESS, 'Success'),
         (FAILED, 'Failed'),
     )
-    sid = models.CharField(max_length=255, blank=True)
+    sid = models.CharField(max_length=255, blank=True, 
+        db_index=True)
     message = models.ForeignKey(Message, 
         on_delete=models.CASCADE, blank=True, null=True)
     text = models.TextField(blank=True)
@@ -522,18 +655,22 @@ class MessageLog(models.Model):
 
     class Meta:
         ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(fields=['message', 'async_task_id', 
+                'contact']),
+        ]
 
     def __str__(self):
         return '{0} sent to {1} on {2}'.format(
-            self.text,
+            self.get_text(),
             self.contact.get_full_name(),
             self.date
         )
 
-    def save(self, *args, **kwargs):
-        if self.message and not self.text:
-            self.text = self.message.body
-        super(MessageLog, self).save(*args, **kwargs)
+    def get_text(self):
+        if not self.text and self.message:
+            return self.message.body
+        return self.text
 
     def get_status(self):
         if self.twilio_status:
@@ -541,6 +678,56 @@ class MessageLog(models.Model):
         else:
             return self.get_status_display()
 
+class StatusEvent(models.Model):
+    """One Twilio delivery callback, kept in the order received"""
+    ACCEPTED = 1
+    SCHEDULED = 2
+    QUEUED = 3
+    SENDING = 4
+    SENT = 5
+    DELIVERED = 6
+    UNDELIVERED = 7
+    FAILED = 8
+    READ = 9
+    CANCELED = 10
+    STATUS_CHOICES = (
+        (ACCEPTED, 'Accepted'),
+        (SCHEDULED, 'Scheduled'),
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (DELIVERED, 'Delivered'),
+        (UNDELIVERED, 'Undelivered'),
+        (FAILED, 'Failed'),
+        (READ, 'Read'),
+        (CANCELED, 'Canceled'),
+    )
+    sid = models.CharField(max_length=64)
+    message = models.ForeignKey(Message, 
+        on_delete=models.CASCADE, blank=True, null=True)
+    status = models.PositiveSmallIntegerField(
+        choices=STATUS_CHOICES)
+    error_code = models.PositiveIntegerField(blank=True, null=True)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['message', 'status', 'timestamp']),
+            models.Index(fields=['sid', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return '{0} {1} at {2}'.format(self.sid, 
+            self.get_status_display(), self.timestamp)
+
+    @classmethod
+    def get_status_code(cls, status):
+        """Maps a Twilio status string to its code, or None"""
+        for code, label in cls.STATUS_CHOICES:
+            if label.lower() == status:
+                return code
+
 class Autoreply(models.Model):
 
     organization = models.ForeignKey(Organization, 
@@ -549,6 +736,8 @@ class Autoreply(models.Model):
     reply = models.CharField(max_length=255)
     tags = models.ManyToManyField(Tag, blank=True)
     prev_msg = models.ManyToManyField(Message, blank=True)
+    match_prefix = models.BooleanField(default=False,
+        help_text='Also reply to messages that start with this text')
 
     class Meta:
         verbose_name_plural = 'autoreplies'
@@ -560,11 +749,18 @@ class Autoreply(models.Model):
         return reverse('autoreply-update', 
             kwargs={'pk':self.id})
 
+    def save(self, *args, **kwargs):
+        super(Autoreply, self).save(*args, **kwargs)
+        autoreplies.forget_index(self.organization_id)
+
+    def delete(self, *args, **kwargs):
+        result = super(Autoreply, self).delete(*args, **kwargs)
+        autoreplies.forget_index(self.organization_id)
+        return result
+
     def add_tags(self, contact):
         if contact:
-            for tag in self.tags.all():
-                contact.tags.add(tag)
-            contact.save()
+            contact.add_tags(self.tags.values_list('id', flat=True))
 
 class Response(models.Model):
     SMS = 'sms'
@@ -589,39 +785,71 @@ class Response(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     organization = models.ForeignKey(
         Organization, on_delete=models.CASCADE)
+    message = models.ForeignKey(Message, 
+        on_delete=models.SET_NULL, blank=True, null=True)
 
     class Meta:
         ordering = ('-timestamp',)
+        indexes = [
+            models.Index(fields=['message', '-timestamp']),
+        ]
 
     def __str__(self):
         return self.body
 
-    def add_contact(self):
+    def get_contact_phone(self):
         if 'whatsapp' in self.phone:
-            self.phone = self.phone.split(':')[1]
+            return self.phone.split(':')[1]
+        return self.phone
+
+    def get_reply(self):
+        """
+        Works out the reply text and autoreply tags without writing 
+        anything, matching what add_contact() will leave the 
+        contact looking like
+        """
+        contact = Contact.objects.filter(
+            phone=self.get_contact_phone(), 
+            organization=self.organization
+        ).only('has_email').first()
+        has_email = bool(contact) and (contact.has_email or 
+            bool(contact.extract_email(self.body)))
+        return self.organization.get_reply(self.body, has_email)
+
+    def add_contact(self):
+        self.phone = self.get_contact_phone()
         contact, created = Contact.objects.get_or_create(
             phone=self.phone, organization=self.organization)
         if not created:
             if not contact.has_email:
                 contact.add_email(self.body)
         self.contact = contact
+        if not self.message_id:
+            self.message_id = self.get_most_recent_message_id()
         self.save()
 
+    def get_most_recent_message_id(self):
+        """The last message sent to the contact before this arrived"""
+        if not self.contact_id:
+            return None
+        return MessageLog.objects.filter(
+            contact_id=self.contact_id,
+            message__isnull=False,
+            status=MessageLog.SUCCESS,
+            timestamp__lte=self.timestamp or timezone.now(),
+        ).order_by('-timestamp').values_list(
+            'message_id', flat=True).first()
+
     def get_most_recent_message(self):
-        messages = Message.objects.filter(
-            organization=self.organization,
-            date_sent__lte=self.date_received).order_by(
-            '-date_sent')
-        if messages:
-            return messages[0]
+        message_id = self.get_most_recent_message_id()
+        if message_id:
+            return Message.objects.get(id=message_id)
         return None
 
     def forward_sms(self):
         result = False
         if self.organization.forward_phone:
-            account_sid, auth_token, phone = \
-            self.organization.get_credentials()
-            client = Client(account_sid, auth_token)
+            client = self.organization.get_client()
             kwargs = {
                 'body':'msg from {}: {}'.format(
                     self.phone, self.body),
@@ -629,7 +857,8 @@ class Response(models.Model):
                 'to': self.organization.forward_phone,
             }
             try:
-                message = client.messages.create(**kwargs)
+                message = throttled_create(client.messages, 
+                    self.organization, **kwargs)
                 result = True
             except Exception as error:
                 print(error)
@@ -643,10 +872,9 @@ class Response(models.Model):
         return result
 
     def forward_voice(self):
+        result = False
         if self.organization.forward_phone:
-            account_sid, auth_token, phone = \
-            self.organization.get_credentials()
-            client = Client(account_sid, auth_token)
+            client = self.organization.get_client()
             kwargs = {
                 'body':'voice msg from {}: {}'.format(
                     self.phone, self.recording),
@@ -654,7 +882,8 @@ class Response(models.Model):
                 'to': self.organization.forward_phone,
             }
             try:
-                message = client.messages.create(**kwargs)
+                message = throttled_create(client.messages, 
+                    self.organization, **kwargs)
                 result = True
             except Exception as error:
                 print(error)
@@ -687,5 +916,125 @@ class Note(models.Model):
     def __str__(self):
         return self.body
 
+class ContactImportJob(models.Model):
+    PREVIEW = 'preview'
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PREVIEW, 'Preview'),
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(UserProfile, 
+        on_delete=models.SET_NULL, blank=True, null=True)
+    file = models.FileField(storage=PrivateMediaStorage(), 
+        upload_to='imports/')
+    # Transfers from US-only lists put +1 in front of every number
+    add_country_code = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, 
+        choices=STATUS_CHOICES, default=PENDING)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.TextField(blank=True)
+    # What the import would change, for jobs uploaded as a preview
+    preview = models.JSONField(blank=True, null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('-date_created',)
+
+    def __str__(self):
+        return 'Import of {0} on {1}'.format(
+            self.file.name, self.date_created)
+
+    def get_absolute_url(self):
+        return reverse('contact-import-detail', 
+            kwargs={'pk':self.id})
+
+    def get_errors(self):
+        return self.errors.splitlines()
+
+    def is_preview(self):
+        return self.status == self.PREVIEW
+
+    def is_finished(self):
+        return self.status in (self.FINISHED, self.FAILED)
+
+    def get_progress(self):
+        # total_rows counts lines, so quoted line breaks can 
+        # make it an overestimate until the job finishes
+        total = self.processed_rows if self.is_finished() \
+            else self.total_rows
+        return {
+            'status': self.get_status_display(),
+            'total': total,
+            'processed': self.processed_rows,
+            'created': self.created_count,
+            'updated': self.updated_count,
+            'errors': self.error_count,
+            'percent': min(int(self.processed_rows * 100 / total), 
+                100) if total else 100,
+            'finished': self.is_finished(),
+        }
+
+class ExportJob(models.Model):
+    CONTACTS = 'contacts'
+    RESPONSES = 'responses'
+    MESSAGE_LOGS = 'message_logs'
+    KIND_CHOICES = (
+        (CONTACTS, 'Contacts'),
+        (RESPONSES, 'Responses'),
+        (MESSAGE_LOGS, 'Send Log'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(UserProfile, 
+        on_delete=models.SET_NULL, blank=True, null=True)
+    # Where the download link is sent once the export is written
+    email = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Limits response and send log exports to one message
+    message = models.ForeignKey(Message, 
+        on_delete=models.SET_NULL, blank=True, null=True)
+    file = models.FileField(storage=PrivateMediaStorage(), 
+        upload_to='exports/', blank=True)
+    status = models.CharField(max_length=20, 
+        choices=STATUS_CHOICES, default=PENDING)
+    row_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        ordering = ('-date_created',)
+
+    def __str__(self):
+        return '{0} export on {1}'.format(
+            self.get_kind_display(), self.date_created)
+
+    def get_absolute_url(self):
+        return reverse('export-download', kwargs={'pk':self.id})
 
+    def get_filename(self):
+        return 'asfour_{0}_{1}.csv'.format(self.kind, 
+            self.date_created.date())
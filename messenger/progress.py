@@ -0,0 +1,87 @@
+from .functions import get_redis
+
+PROGRESS_TTL = 60 * 60 * 24 * 7
+
+def get_progress_key(msg_id):
+    return 'progress:message:{}'.format(msg_id)
+
+def start_progress(msg_id, total):
+    """Resets a message's send counters at the start of a blast"""
+    conn = get_redis()
+    if conn is None:
+        return
+    key = get_progress_key(msg_id)
+    pipe = conn.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping={'total': total, 'sent': 0, 'failed': 0})
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.execute()
+
+def get_batches_key(blast_id):
+    return 'progress:batches:{}'.format(blast_id)
+
+def start_batches(blast_id, count):
+    """Records a blast's batches as outstanding"""
+    conn = get_redis()
+    if conn is None or not count:
+        return
+    key = get_batches_key(blast_id)
+    pipe = conn.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, *range(count))
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.execute()
+
+def finish_batch(blast_id, index):
+    """
+    Marks one of a blast's batches as sent. Returns True only for 
+    the batch that leaves none outstanding, so a redelivered batch 
+    can't finish the blast twice.
+    """
+    conn = get_redis()
+    if conn is None:
+        return False
+    key = get_batches_key(blast_id)
+    pipe = conn.pipeline()
+    pipe.srem(key, index)
+    pipe.scard(key)
+    removed, remaining = pipe.execute()
+    return bool(removed) and not remaining
+
+def record_progress(msg_id, sent, failed):
+    """Adds one checkpoint's worth of sends to the counters"""
+    conn = get_redis()
+    if conn is None:
+        return
+    key = get_progress_key(msg_id)
+    pipe = conn.pipeline()
+    pipe.hincrby(key, 'sent', sent)
+    pipe.hincrby(key, 'failed', failed)
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.execute()
+
+def get_progress(message):
+    """
+    Returns the message's send counters. Once they expire, or for 
+    messages sent before they existed, the totals stored on the 
+    message are reported instead.
+    """
+    counts = {}
+    conn = get_redis()
+    if conn is not None:
+        counts = conn.hgetall(get_progress_key(message.id))
+    if counts:
+        total, sent, failed = (int(counts.get(field, 0)) 
+            for field in (b'total', b'sent', b'failed'))
+    else:
+        sent, failed = message.sent_count, message.failed_count
+        total = sent + failed
+    done = sent + failed
+    return {
+        'total': total,
+        'sent': sent,
+        'failed': failed,
+        'remaining': max(total - done, 0),
+        'percent': int(done * 100 / total) if total else 100,
+        'finished': bool(message.date_finished),
+    }
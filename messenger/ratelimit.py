@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from twilio.base.exceptions import TwilioRestException
+
+from .functions import get_redis
+
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1
+
+# Token bucket shared by every worker. Each call reserves one 
+# token, letting the balance go negative, and returns how many 
+# seconds the caller must wait before its request is allowed.
+TOKEN_BUCKET = """
+redis.replicate_commands()
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'timestamp', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+if tokens < 0 then
+    return tostring(-tokens / rate)
+end
+return '0'
+"""
+
+_script = None
+
+def get_bucket_key(organization, sender, verb='messages'):
+    return 'ratelimit:{0}:{1}:{2}'.format(
+        organization.id, sender, verb)
+
+def reserve(organization, sender, verb='messages'):
+    """
+    Reserves a request slot for the organization's sender number 
+    and returns the number of seconds to wait before using it
+    """
+    global _script
+    conn = get_redis()
+    if conn is None:
+        return 0
+    if _script is None:
+        _script = conn.register_script(TOKEN_BUCKET)
+    rate = organization.messages_per_second
+    wait = _script(
+        keys=[get_bucket_key(organization, sender, verb)],
+        args=[rate, rate],
+    )
+    return float(wait)
+
+def throttle(organization, sender, verb='messages'):
+    """Blocks until the sender may make another Twilio request"""
+    wait = reserve(organization, sender, verb)
+    if wait > 0:
+        time.sleep(wait)
+
+def throttled_create(resource, organization, verb='messages', 
+    **kwargs):
+    """
+    Calls resource.create(**kwargs) within the organization's 
+    rate limit, backing off and retrying when Twilio answers 429
+    """
+    sender = kwargs.get('from_', organization.phone)
+    for attempt in range(MAX_RETRIES + 1):
+        throttle(organization, sender, verb)
+        try:
+            return resource.create(**kwargs)
+        except TwilioRestException as error:
+            if error.status != 429 or attempt == MAX_RETRIES:
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+async def athrottled_create(resource, organization, verb='messages', 
+    **kwargs):
+    """Awaitable throttled_create, for async http clients"""
+    sender = kwargs.get('from_', organization.phone)
+    for attempt in range(MAX_RETRIES + 1):
+        # reserve() is a blocking Redis call
+        wait = await asyncio.to_thread(reserve, organization, 
+            sender, verb)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await resource.create_async(**kwargs)
+        except TwilioRestException as error:
+            if error.status != 429 or attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
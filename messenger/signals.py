@@ -0,0 +1,47 @@
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import autoreplies, membership
+from .models import Autoreply, Contact, Tag
+
+@receiver(m2m_changed, sender=Contact.tags.through)
+def update_tag_index(sender, instance, action, reverse, pk_set, 
+    **kwargs):
+    """Keeps the tag membership index in step with Contact.tags"""
+    if action == 'pre_clear':
+        related = instance.contact_set if reverse else instance.tags
+        instance._cleared_ids = list(
+            related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_ids', [])
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        tag_ids, contact_ids = [instance.id], list(pk_set)
+    else:
+        tag_ids, contact_ids = list(pk_set), [instance.id]
+    if action == 'post_add':
+        membership.add_members(instance.organization_id, tag_ids, 
+            contact_ids)
+    else:
+        membership.remove_members(instance.organization_id, tag_ids, 
+            contact_ids)
+
+@receiver(pre_delete, sender=Contact)
+def remove_deleted_contact(sender, instance, **kwargs):
+    tag_ids = list(instance.tags.values_list('id', flat=True))
+    membership.remove_members(instance.organization_id, tag_ids, 
+        [instance.id])
+
+@receiver(post_delete, sender=Tag)
+def remove_deleted_tag(sender, instance, **kwargs):
+    membership.forget_tag(instance.organization_id, instance.id)
+    # The cascade to Autoreply.tags doesn't send m2m_changed
+    autoreplies.forget_index(instance.organization_id)
+
+@receiver(m2m_changed, sender=Autoreply.tags.through)
+def update_autoreply_index(sender, instance, action, reverse, 
+    **kwargs):
+    if action.startswith('post_'):
+        autoreplies.forget_index(instance.organization_id)
@@ -1,15 +1,25 @@
 from __future__ import absolute_import, unicode_literals
+import datetime
+import json
 import time
 import os
 
 from django.apps import apps
+from django.conf import settings
 from django.contrib import messages
+from django.db.models import Count, Q
+from django.utils import timezone
 
-from twilio.rest import Client
+from celery import chord, group
 
 from asfour.celery import app
 
 from . import functions
+from .callbacks import drain_statuses, link_events
+from .engines import get_engine
+from .exports import get_download_url, get_email_content, run_export
+from .imports import run_import
+from .progress import finish_batch, record_progress
 
 @app.task
 def task_send_email(to, subject, content):
@@ -19,53 +29,219 @@ def task_send_email(to, subject, content):
     return 'done'
 
 @app.task
+def task_send_sms(contact_id, body):
+    Contact = apps.get_model(app_label='messenger', 
+        model_name='Contact')
+    contact = Contact.objects.select_related('organization') \
+        .get(id=contact_id)
+    contact.send_sms(body)
+    return 'done'
+
+@app.task
+def process_response(response_id, tag_ids=None):
+    """
+    Links an inbound response to its contact and the message it 
+    answers, forwards it and applies any autoreply tags, after 
+    the webhook has replied
+    """
+    Response = apps.get_model(app_label='messenger', 
+        model_name='Response')
+    response = Response.objects.select_related('organization') \
+        .get(id=response_id)
+    response.add_contact()
+    if response.method == Response.VOICE:
+        response.forward_voice()
+    else:
+        response.forward_sms()
+    if tag_ids:
+        response.contact.add_tags(tag_ids)
+    return 'done'
+
+@app.task
+def apply_status_callbacks():
+    """Writes buffered Twilio status callbacks in batches"""
+    return drain_statuses()
+
+@app.task(acks_late=True, reject_on_worker_lost=True)
+def import_contacts(job_id):
+    """Imports an uploaded contact CSV in bulk batches"""
+    ContactImportJob = apps.get_model(app_label='messenger', 
+        model_name='ContactImportJob')
+    return run_import(ContactImportJob.objects.get(id=job_id))
+
+@app.task
+def export_data(job_id):
+    """Writes an export to private storage and emails a link to it"""
+    ExportJob = apps.get_model(app_label='messenger', 
+        model_name='ExportJob')
+    job = ExportJob.objects.get(id=job_id)
+    run_export(job)
+    if job.email:
+        task_send_email.delay(
+            to=job.email,
+            subject='Your Asfour export is ready',
+            content=get_email_content(job, get_download_url(job)),
+        )
+    return 'done'
+
 def message_log(MessageLog, message, contact, user_profile, 
-    sid, error):
-    log = MessageLog.objects.create(
+    sid, error, blast_id=''):
+    """Builds an unsaved log row, for bulk insertion by the caller"""
+    log = MessageLog(
         message=message,
         organization=message.organization,
         contact=contact,
-        sid=sid,
-        error=error
+        sid=sid or '',
+        sender=user_profile,
+        async_task_id=blast_id,
+        is_finished=True,
     )
-    if user_profile:
-        log.sender = user_profile
     if error:
         log.status = MessageLog.FAILED
-        log.error = error
+        log.error = str(error)
     return log
 
 
-@app.task
-def send_messages(msg_id, voice_uri=None, user_profile=None):
+@app.task(acks_late=True, reject_on_worker_lost=True)
+def send_messages(msg_id, contact_ids=None, voice_uri=None, 
+    user_profile=None, blast_id='', batch=None):
+    """
+    Sends a message to one batch of its recipients. Message.send() 
+    splits the recipients into batches of contact_ids; with no 
+    contact_ids the message goes to every recipient.
+
+    Logs are written every SEND_CHECKPOINT_SIZE recipients and 
+    tagged with blast_id, so a batch redelivered after its worker 
+    died skips contacts that were already sent to in this blast.
+    The batch that completes the blast queues finish_messages.
+    """
     Message = apps.get_model(app_label='messenger', 
         model_name='Message')
     MessageLog = apps.get_model(app_label='messenger', 
         model_name='MessageLog')
-    message = Message.objects.get(id=msg_id)
-    account_sid, auth_token, phone = message.organization \
-        .get_credentials()
-    client = Client(account_sid, auth_token)
-    verb = message.get_client_verb()
-    client_action = getattr(client, verb)
+    message = Message.objects.select_related('organization') \
+        .get(id=msg_id)
+    phone = message.organization.phone
     kwargs = message.get_kwargs(phone, voice_uri)
-    for contact in message.contacts.all():
-        try:
-            kwargs['to'] = get_recipient(message, contact)
-            msg = client_action.create(**kwargs)
-            sid = getattr(msg, 'sid', None)
-            error = ""
-            print('sent!')
-        except Exception as e:
-            sid = ""
-            error = e
-            print(error)
-        log = message_log(MessageLog, message, contact, 
-            user_profile, sid, error)
-        log.save()
-
-def get_recipient(message, contact):
-    if message.method == message.WHATSAPP:
-        return 'whatsapp:{}'.format(contact.phone)
+    contacts = message.contacts.order_by('id')
+    if contact_ids is not None:
+        contacts = contacts.filter(id__in=contact_ids)
+    if blast_id:
+        sent = MessageLog.objects.filter(message=message, 
+            async_task_id=blast_id, status=MessageLog.SUCCESS)
+        if contact_ids is not None:
+            sent = sent.filter(contact_id__in=contact_ids)
+        contacts = contacts.exclude(
+            id__in=sent.values('contact_id'))
+    contacts = list(contacts)
+    send = get_engine()
+    size = settings.SEND_CHECKPOINT_SIZE
+    for results in send(message, contacts, kwargs, size):
+        logs = [
+            message_log(MessageLog, message, contact, 
+                user_profile, sid, error, blast_id)
+            for contact, sid, error in results
+        ]
+        MessageLog.objects.bulk_create(logs)
+        link_events([log.sid for log in logs], msg_id)
+        failed = sum(1 for log in logs 
+            if log.status == MessageLog.FAILED)
+        record_progress(msg_id, len(logs) - failed, failed)
+    if batch is not None and finish_batch(blast_id, batch):
+        finish_messages.delay(msg_id, blast_id)
+
+@app.task
+def finish_messages(msg_id, blast_id=''):
+    """
+    Runs once every batch of a blast has been sent. A blast that 
+    was superseded by a resend leaves the message unfinished.
+    """
+    Message = apps.get_model(app_label='messenger', 
+        model_name='Message')
+    MessageLog = apps.get_model(app_label='messenger', 
+        model_name='MessageLog')
+    counts = MessageLog.objects.filter(message_id=msg_id, 
+        async_task_id=blast_id).aggregate(
+            sent=Count('id', filter=Q(status=MessageLog.SUCCESS)),
+            failed=Count('id', filter=Q(status=MessageLog.FAILED)),
+        )
+    Message.objects.filter(id=msg_id, blast_id=blast_id).update(
+        date_finished=timezone.now(),
+        sent_count=counts['sent'],
+        failed_count=counts['failed'],
+    )
+    cancel_schedule(msg_id, blast_id)
+    return 'done'
+
+@app.task
+def release_batches(msg_id, batches, is_last=True, first_batch=0, 
+    **kwargs):
+    """
+    Queues a send_messages subtask per batch, numbered from 
+    first_batch so the last one to finish can finish the message. 
+    Without Redis to count batches, the last release chords its 
+    batches into finish_messages instead.
+    """
+    subtasks = [
+        send_messages.si(msg_id=msg_id, contact_ids=batch, 
+            batch=first_batch + index, **kwargs)
+        for index, batch in enumerate(batches)
+    ]
+    if functions.get_redis() is None:
+        if is_last:
+            chord(subtasks)(finish_messages.si(msg_id, 
+                kwargs.get('blast_id', '')))
+        elif subtasks:
+            group(subtasks).apply_async()
+    elif subtasks:
+        group(subtasks).apply_async()
+    elif is_last:
+        finish_messages.delay(msg_id, kwargs.get('blast_id', ''))
+    return 'done'
+
+def get_schedule_prefix(msg_id, blast_id=''):
+    prefix = 'message-{}-'.format(msg_id)
+    if blast_id:
+        prefix += '{}-'.format(blast_id)
+    return prefix
+
+def cancel_schedule(msg_id, blast_id=''):
+    """
+    Removes any scheduled releases of the blast, or of every blast 
+    of the message
+    """
+    ClockedSchedule = apps.get_model(app_label='django_celery_beat',
+        model_name='ClockedSchedule')
+    ClockedSchedule.objects.filter(
+        periodictask__name__startswith=get_schedule_prefix(msg_id, 
+            blast_id)
+    ).delete()
+
+def schedule_batches(msg_id, batches, start, window=None, **kwargs):
+    """
+    Creates one-off django_celery_beat tasks that release the 
+    batches at start, spread evenly across window minutes if set
+    """
+    ClockedSchedule = apps.get_model(app_label='django_celery_beat',
+        model_name='ClockedSchedule')
+    PeriodicTask = apps.get_model(app_label='django_celery_beat',
+        model_name='PeriodicTask')
+    if window and batches:
+        slots = [[batch] for batch in batches]
+        interval = datetime.timedelta(minutes=window) / len(slots)
     else:
-        return contact.phone
+        slots = [batches]
+        interval = datetime.timedelta(0)
+    for index, slot in enumerate(slots):
+        clocked = ClockedSchedule.objects.create(
+            clocked_time=start + interval * index)
+        PeriodicTask.objects.create(
+            name='{0}{1}'.format(get_schedule_prefix(msg_id, 
+                kwargs.get('blast_id')), index),
+            task='messenger.tasks.release_batches',
+            clocked=clocked,
+            one_off=True,
+            kwargs=json.dumps(dict(kwargs, msg_id=msg_id, 
+                batches=slot, first_batch=index * len(slot), 
+                is_last=index == len(slots) - 1)),
+        )
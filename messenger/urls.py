@@ -17,6 +17,11 @@ urlpatterns = [
         path('', views.ContactList.as_view(), name='contact-list'),
         path('add/', views.ContactCreate.as_view(), name='contact-create'),
         path('import/', views.ContactImport.as_view(), name='contact-import'),
+        path('import/<int:pk>/', include([
+            path('', views.ContactImportDetail.as_view(), name='contact-import-detail'),
+            path('progress/', views.ContactImportProgress.as_view(), name='contact-import-progress'),
+            path('start/', views.ContactImportStart.as_view(), name='contact-import-start'),
+        ])),
         path('export/', views.ContactExport.as_view(), name='contact-export'),
         path('<pk>/', include([
             path('', views.ContactDetail.as_view(), name='contact-detail'),
@@ -28,11 +33,13 @@ urlpatterns = [
         path('', views.MessageList.as_view(), name='message-list'),
         path('log/',views.MessageLogList.as_view(), name='messagelog-list'),
         path('add/',views.MessageCreate.as_view(), name='message-create'),
+        path('recipients/', views.MessageRecipients.as_view(), name='message-recipients'),
         # path('export/', views.CommitmentExport.as_view(), name='commitment-export'),
         path('<pk>/', include([
             path('', views.MessageDetail.as_view(), name='message-detail'),
             path('update/', views.MessageUpdate.as_view(), name='message-update'),
             path('send/', views.MessageSend.as_view(), name='message-send'),
+            path('progress/', views.MessageProgress.as_view(), name='message-progress'),
             path('delete/', views.MessageDelete.as_view(), name='message-delete'),
         ])),
         path('call/', include([
@@ -57,6 +64,11 @@ urlpatterns = [
     # path('chatbot/', views.ChatBot.as_view(), name='chatbot'),
     path('status-callback/<int:pk>', views.StatusCallback.as_view(), name='status-callback'),
     path('response/<medium>/<int:pk>/', views.HarvestResponse.as_view(), name='harvest-response'),
+    path('exports/', include([
+        path('', views.ExportList.as_view(), name='export-list'),
+        path('add/', views.ExportCreate.as_view(), name='export-create'),
+        path('<int:pk>/download/', views.ExportDownload.as_view(), name='export-download'),
+    ])),
     path('responses/', include([
         path('', views.ResponseList.as_view(), name='response-list'),
         path('export/', views.ResponseExport.as_view(), name='response-export'),
@@ -1,9 +1,9 @@
 import csv
 import datetime
-import io
 import openai
-import re
 
+from asgiref.sync import sync_to_async
+from itertools import islice
 from django.apps import apps
 from django.conf import settings
 from django.contrib import messages
@@ -11,13 +11,13 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db.models import F, Q, Value, CharField
-from django.db.models.functions import Concat
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F, Q, Value, CharField, TextField
+from django.db.models.functions import Coalesce, Concat, NullIf
 from django.http import (HttpResponse, HttpResponseForbidden, 
-    StreamingHttpResponse)
-from django.shortcuts import redirect, render
+    JsonResponse, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404, redirect, render
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
 from django.views.generic import View, DetailView, ListView
 from django.views.generic.edit import CreateView, UpdateView
 from django.views.generic.edit import DeleteView
@@ -25,21 +25,25 @@ from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 
 from celery.result import AsyncResult
-from .decorators import validate_twilio_request
+from .callbacks import push_status
+from .decorators import (deduplicate_twilio_request, 
+    validate_twilio_request)
+from .exports import get_download_url
 from .forms import OrganizationForm, MessageForm
-from .functions import send_email, export_contacts
-from .models import (Autoreply, Contact, Invoice, Message, 
-    MessageLog, Note, Organization, Response, Tag, UserProfile)
-from .tasks import send_messages
+from .functions import (export_contacts, export_responses, get_redis, 
+    send_email)
+from .membership import count_members, get_tag_counts
+from .imports import count_rows, preview_import
+from .models import (Autoreply, Contact, ContactImportJob, ExportJob, 
+    Invoice, Message, MessageLog, Note, Organization, Response, Tag, 
+    UserProfile)
+from .progress import get_progress
+from .tasks import (export_data, import_contacts, process_response, 
+    send_messages, task_send_sms)
 
 from twilio.twiml.voice_response import VoiceResponse, Dial
 from twilio.twiml.messaging_response import MessagingResponse
 
-
-decorators = [
-    csrf_exempt, require_POST, validate_twilio_request
-]
-
 class Echo:
     """An object that implements just the write method
     of the file-like interface.
@@ -50,6 +54,33 @@ class Echo:
         """
         return value
 
+# Rows handed from the database thread to the event loop at a time
+STREAM_CHUNK_SIZE = 500
+
+async def iterate_in_chunks(rows, size=STREAM_CHUNK_SIZE):
+    """
+    Feeds a blocking iterator to an async response a chunk at 
+    a time, since Django buffers synchronous iterators under ASGI
+    """
+    rows = iter(rows)
+    take = sync_to_async(lambda: list(islice(rows, size)))
+    chunk = await take()
+    while chunk:
+        for row in chunk:
+            yield row
+        chunk = await take()
+
+def stream_csv(request, rows, filename):
+    """Streams rows as a CSV download without holding them in memory"""
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in rows)
+    if isinstance(request, ASGIRequest):
+        lines = iterate_in_chunks(lines)
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment;filename="{}"'.format(
+        filename)
+    return response
+
 class LoginRequiredMixin(LoginRequiredMixin):
 
     def get_profile(self):
@@ -190,7 +221,15 @@ class TagView(View):
     success_url = reverse_lazy('tag-list')
 
 class TagList(TagView, OrgListView):
-    pass
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        tags = context['tag_list']
+        counts = get_tag_counts(self.get_profile().organization_id,
+            [tag.id for tag in tags])
+        for tag in tags:
+            tag.contact_count = counts.get(tag.id, 0)
+        return context
 
 class TagDetail(TagView, OrgDetailView):
     pass
@@ -229,14 +268,7 @@ class ContactExport(ContactList):
 
     def get(self, request):
         rows = export_contacts(self.get_queryset())
-        pseudo_buffer = Echo()
-        writer = csv.writer(pseudo_buffer)
-        response = StreamingHttpResponse(
-            (writer.writerow(row) for row in rows),
-            content_type="text/csv")
-        content_disp = 'attatchment;filename="contacts.csv"'
-        response['Content-Disposition'] = content_disp
-        return response
+        return stream_csv(request, rows, 'contacts.csv')
 
 class ContactDetail(ContactView, OrgDetailView):
     
@@ -246,7 +278,8 @@ class ContactDetail(ContactView, OrgDetailView):
         outbound = contact.messagelog_set.annotate(
             model_type=Value(
                 'Outbound', output_field=CharField()),
-            msg_text=F('text')
+            msg_text=Coalesce(NullIf('text',
+                Value('', output_field=TextField())), 'message__body')
         ).values(
             'id', 'timestamp', 'msg_text', 'model_type'
         )
@@ -264,7 +297,7 @@ class ContactDetail(ContactView, OrgDetailView):
     def post(self, request, **kwargs):
         contact = self.get_object()
         if request.POST.get('body'):
-            contact.send_sms(request.POST.get('body'))
+            task_send_sms.delay(contact.id, request.POST.get('body'))
             messages.success(request, 
                 'Message Sent.')
         return redirect(reverse(
@@ -283,103 +316,75 @@ class ContactDelete(OrgDeleteView):
 
 class ContactImport(ContactList):
     template_name = 'messenger/contact_import.html'
+    add_country_code = False
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['import_jobs'] = ContactImportJob.objects.filter(
+            organization=self.get_org())[:5]
+        return context
 
     def post(self, request, **kwargs):
-        organization = request.user.userprofile.organization
+        profile = request.user.userprofile
         try:
             import_file = request.FILES['csv_file']
         except KeyError:
             messages.error(request, 'Please upload a file.')
-        else:
-            errors, new_count = self.import_csv_data(import_file, 
-                organization=organization)
-            print(errors)
-            messages.success(request, 
-                'Contacts successfully uploaded. {} New'.format(new_count))
-        return redirect(reverse('home'))
-
-    def import_csv_data(self, import_file, organization):
-        errors = []
-        try:
-            # with open(import_file, 'rt', encoding="utf-8",
-            # errors='ignore') as csvfile:
-            reader = csv.DictReader(
-                io.StringIO(
-                    import_file.read().decode('utf-8')
-                )
-            )
-        except Exception as error:
-            errors.append(error)
-            messages.error(self.request, \
-                'Failed to read file. Please make sure \
-                the file is in CSV format.')
-        else:
-            errors, new_count = self.enumerate_rows(reader, organization)
-        return errors, new_count
-
-    # Loop through CSV, skipping header row.
-    def enumerate_rows(self, reader, org, start=1):
-        row_errors = []
-        new_count = 0
-        # Index is for row numbers in error message-s.
-        for index, contact in enumerate(reader, start=1):
-            row_errors = []
+            return redirect(reverse('contact-import'))
+        kwargs = {
+            'organization': profile.organization,
+            'created_by': profile,
+            'add_country_code': self.add_country_code,
+        }
+        if request.POST.get('preview'):
             try:
-                created = self.import_contact_row(contact, org)
-                if created:
-                    new_count += 1
-            except Exception as error:
-                print(error)
-                row_errors.append('Row {0}: {1}'.format(
-                    index, error))
-        return row_errors, new_count
-
-    def import_contact_row(self, contact_dict, org):
-        new_contacts = 0
-        phone = re.sub("[^0-9]", "", contact_dict['phone'])
-        if '+' not in phone:
-            if len(phone) == 10:
-                phone = '+1' + phone
-            elif len(phone) == 11 and phone[0] == '1':
-                phone = '+' + phone
-        contact, created = Contact.objects.get_or_create(
-            phone=phone,
-            organization=org)
-        contact.first_name = contact_dict['first_name']
-        contact.last_name = contact_dict['last_name']
-        contact.email = contact_dict['email']
-        for tagname in ('tag1', 'tag2', 'tag3'):
-            if contact_dict.get(tagname):
-                tag, created = Tag.objects.get_or_create(
-                    name=contact_dict[tagname],
-                    organization=org)
-                contact.tags.add(tag)
-        contact.save()
-        return created
+                preview = preview_import(import_file, 
+                    profile.organization_id, self.add_country_code)
+            except (UnicodeDecodeError, csv.Error):
+                messages.error(request, 'Failed to read file. Please '
+                    'make sure the file is in CSV format.')
+                return redirect(reverse('contact-import'))
+            kwargs.update(status=ContactImportJob.PREVIEW, 
+                preview=preview, total_rows=preview['rows'])
+        else:
+            kwargs['total_rows'] = count_rows(import_file)
+        job = ContactImportJob.objects.create(file=import_file, 
+            **kwargs)
+        if not job.is_preview():
+            import_contacts.delay(job.id)
+            messages.success(request, 'Import started.')
+        return redirect(job.get_absolute_url())
 
 class ContactTransfer(ContactImport):
+    add_country_code = True
 
-    def import_contact_row(self, contact_dict, org):
-        print(contact_dict)
-        phone = re.sub("[^0-9]", "", contact_dict['phone'])
-        if '+' not in phone:
-            phone = '+1' + phone
-        print('adding {}'.format(phone))  
-        contact, created = Contact.objects.get_or_create(
-            phone=phone,
-            organization=org)
-        print(contact, created)
-        contact.first_name = contact_dict['first_name']
-        contact.last_name = contact_dict['last_name']
-        contact.email = contact_dict['email']
-        for tagname in ('tag1', 'tag2', 'tag3'):
-            if contact_dict.get(tagname):
-                tag, created = Tag.objects.get_or_create(
-                    name=contact_dict[tagname],
-                    organization=org)
-                contact.tags.add(tag)
-        contact.save()
-        return contact
+class ContactImportDetail(OrgDetailView):
+    model = ContactImportJob
+
+class ContactImportStart(LoginRequiredMixin, View):
+
+    def post(self, request, **kwargs):
+        job = get_object_or_404(ContactImportJob,
+            id=self.kwargs.get('pk'),
+            organization_id=self.get_profile().organization_id,
+        )
+        # Only the first click on a previewed job queues it
+        started = ContactImportJob.objects.filter(id=job.id, 
+            status=ContactImportJob.PREVIEW).update(
+            status=ContactImportJob.PENDING)
+        if started:
+            import_contacts.delay(job.id)
+            messages.success(request, 'Import started.')
+        return redirect(job.get_absolute_url())
+
+class ContactImportProgress(LoginRequiredMixin, View):
+
+    def get(self, request, **kwargs):
+        job = get_object_or_404(ContactImportJob,
+            id=self.kwargs.get('pk'),
+            organization_id=self.get_profile().organization_id,
+        )
+        return JsonResponse(job.get_progress())
 
 class MessageView(View):
     model = Message
@@ -413,14 +418,10 @@ class MessageView(View):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        contacts = Contact.objects.filter(
-            tags__in=self.object.tags.all()).distinct()
-        for contact in contacts:
-            self.object.contacts.add(contact)
         if self.request.POST.get('add_all'):
-            org = self.request.user.userprofile.organization
-            contacts = org.contact_set.all()
-            self.object.contacts.set(contacts)
+            self.object.add_recipients(everyone=True)
+        else:
+            self.object.add_recipients(tags=self.object.tags.all())
         # for contact in contacts:
         #     if contact not in self.object.contacts.all():
         #         self.object.contacts.add(contact)
@@ -473,16 +474,7 @@ class MessageDetail(MessageView, OrgDetailView):
 
     def get_responses(self, message):
         if message.date_sent:
-            rdict = {
-                'contact__in': message.contacts.all(),
-                'timestamp__gt': message.date_sent,
-            }
-            next_msg = message.next()
-            if next_msg:
-                rdict['timestamp__lte'] = next_msg.date_sent
-            responses = Response.objects.filter(
-                **rdict).select_related('contact').distinct()
-            return responses
+            return message.response_set.select_related('contact')
         return None
 
 class MessageCreate(MessageView, OrgCreateView):
@@ -505,9 +497,40 @@ class MessageSend(MessageDetail):
             messages.success(request, 'Call Initiated!')
         else:
             message.send(request)
-            messages.success(request, 'Message Sent!')
+            if message.is_scheduled():
+                messages.success(request, 'Message Scheduled!')
+            else:
+                messages.success(request, 'Message Sent!')
         return redirect(message.get_absolute_url())
 
+class MessageRecipients(LoginRequiredMixin, View):
+
+    def get(self, request, **kwargs):
+        org_id = self.get_profile().organization_id
+        if request.GET.get('add_all'):
+            count = Contact.objects.filter(
+                organization_id=org_id).count()
+        else:
+            count = count_members(org_id, 
+                union=self.get_tag_ids('tags'),
+                intersect=self.get_tag_ids('intersect'),
+                exclude=self.get_tag_ids('exclude'))
+        return JsonResponse({'count': count})
+
+    def get_tag_ids(self, param):
+        return [int(tag_id) for tag_id in 
+            self.request.GET.getlist(param) if tag_id.isdigit()]
+
+class MessageProgress(LoginRequiredMixin, View):
+
+    def get(self, request, **kwargs):
+        message = get_object_or_404(
+            Message.objects.only('id', 'date_finished'),
+            id=self.kwargs.get('pk'),
+            organization_id=self.get_profile().organization_id,
+        )
+        return JsonResponse(get_progress(message))
+
 class MessageLogList(OrgListView):
     model = MessageLog
     paginate_by = 500
@@ -532,65 +555,62 @@ class ResponseExport(ResponseList):
     def get_queryset(self):
         queryset = super().get_queryset()
         if self.request.GET.get('msg_id'):
-            message = Message.objects.get(
-                id=self.request.GET.get('msg_id'))
             queryset = queryset.filter(
-                timestamp__gt=message.date_sent)
-            if message.next():
-                next_msg = message.next()
-                queryset = queryset.filter(
-                    timestamp__lte=next_msg.date_sent)
+                message_id=self.request.GET.get('msg_id'))
         return queryset
 
     def get(self, request, **kwargs):
-        resp = super().get(request, **kwargs)
-        rows = self.get_response_list(self.get_queryset())
-        pseudo_buffer = Echo()
-        writer = csv.writer(pseudo_buffer)
-        response = StreamingHttpResponse(
-            (writer.writerow(row) for row in rows),
-            content_type="text/csv")
-        today = datetime.date.today()
-        filename = 'asfour_responses_{}'.format(today)
-        cont_disp = 'attachment;filename="{}.csv"'.format(
-            filename)
-        response['Content-Disposition'] = cont_disp
-        return response
+        rows = export_responses(self.get_queryset())
+        filename = 'asfour_responses_{}.csv'.format(
+            datetime.date.today())
+        return stream_csv(request, rows, filename)
+
+class ExportList(OrgListView):
+    model = ExportJob
+    paginate_by = 50
+
+class ExportCreate(LoginRequiredMixin, View):
 
-    def get_response_list(self, queryset):
-        header = ['phone', 'first_name', 'last_name', 'tags',
-        'response', 'method', 'recording', 'timestamp',
-        'last_message_received']
-        rows = [header,]
-        for response in queryset:
-            print('getting row')
-            rows.append(self.get_response_row(response))
-        return rows
-
-    def get_response_row(self, response):
-        first_name, last_name, tags = None, None, None
-        if response.contact:
-            first_name = response.contact.first_name
-            last_name = response.contact.last_name
-            if response.contact.tags.count():
-                tags = '; '.join([tag.name for tag in \
-                response.contact.tags.all()]),
-        row = [
-            response.phone,
-            first_name,
-            last_name,
-            tags,
-            response.body,
-            response.get_method_display(),
-            getattr(response.recording, 'url', None),
-            response.timestamp,
-            response.get_most_recent_message()
-        ]
-        return row
+    def post(self, request, **kwargs):
+        profile = self.get_profile()
+        kind = request.POST.get('kind')
+        if kind not in dict(ExportJob.KIND_CHOICES):
+            messages.error(request, 'Unknown export.')
+            return redirect(reverse('export-list'))
+        message = None
+        if request.POST.get('msg_id'):
+            message = get_object_or_404(Message,
+                id=request.POST.get('msg_id'),
+                organization=profile.organization,
+            )
+        job = ExportJob.objects.create(
+            organization=profile.organization,
+            created_by=profile,
+            email=request.user.email,
+            kind=kind,
+            message=message,
+        )
+        export_data.delay(job.id)
+        if job.email:
+            messages.success(request, 'Export started. A download '
+                'link will be emailed to {}.'.format(job.email))
+        else:
+            messages.success(request, 'Export started.')
+        return redirect(reverse('export-list'))
+
+class ExportDownload(LoginRequiredMixin, View):
+
+    def get(self, request, **kwargs):
+        job = get_object_or_404(ExportJob,
+            id=self.kwargs.get('pk'),
+            organization_id=self.get_profile().organization_id,
+            status=ExportJob.FINISHED,
+        )
+        return redirect(get_download_url(job))
 
 class AutoreplyView(View):
     model = Autoreply
-    fields = ('text', 'reply', 'tags')
+    fields = ('text', 'reply', 'match_prefix', 'tags')
     success_url = reverse_lazy('autoreply-list')
 
     def get_form(self, form_class=None):
@@ -608,12 +628,13 @@ class AutoreplyUpdate(AutoreplyView, OrgUpdateView):
 class AutoreplyList(AutoreplyView, OrgListView):
     pass
 
-@method_decorator(decorators, name='dispatch')
+@method_decorator(csrf_exempt, name='dispatch')
 class VoiceCall(View):
     model = Message
+    http_method_names = ['post']
 
-    def get_twiml(self):
-        message = Message.objects.get(
+    async def get_twiml(self):
+        message = await Message.objects.aget(
             id=self.kwargs.get('msg_id'))
         twiml_response = VoiceResponse()
         twiml_response.play(message.recording.url)
@@ -621,7 +642,7 @@ class VoiceCall(View):
             print('REQUEST FOR RESPONSE ACTIVATED')
             twiml_response.record(
                 action=reverse('record-call', kwargs={
-                    'pk': message.organization.id,
+                    'pk': message.organization_id,
                     'msg_id': message.id
                     }),
                 method='POST',
@@ -634,34 +655,34 @@ class VoiceCall(View):
         
         return twiml_response
 
-    def post(self, request, **kwargs):
+    @validate_twilio_request
+    async def post(self, request, **kwargs):
         print('its a post!')
         return HttpResponse(
-            self.get_twiml(),
+            await self.get_twiml(),
             content_type='application/xml'
         )
 
-@method_decorator(decorators, name='dispatch')
+@method_decorator(csrf_exempt, name='dispatch')
 class RecordCall(View):
+    http_method_names = ['post']
 
-    def post(self, request, **kwargs):
-        message = Message.objects.get(
-            id=self.kwargs.get('msg_id'))
+    @validate_twilio_request
+    async def post(self, request, **kwargs):
+        message = await Message.objects.only(
+            'id', 'organization_id').aget(id=self.kwargs.get('msg_id'))
         session_id = request.POST['CallSid']
-        request_body = request.POST.get('RecordingUrl')
         phone_number = request.POST.get('To')
-        response = Response.objects.create(
+        response = await Response.objects.acreate(
             method=Response.VOICE,
             phone=phone_number,
+            body=request.POST.get('TranscriptionText', ''),
             recording=request.POST.get('RecordingUrl'),
             sid=session_id,
-            organization=message.organization,
+            organization=request.organization,
+            message=message,
         )
-        response.add_contact()
-        if 'TranscriptionText' in request.POST:
-            response.body = request.POST.get(
-                'TranscriptionText')
-            response.save()
+        await sync_to_async(response.add_contact)()
         twiml_response = VoiceResponse()
         # twiml_response.say('Thank you, goodbye')
         # twiml_response.hangup()
@@ -672,7 +693,7 @@ class RecordCall(View):
         twiml_response.redirect(
             reverse(
                 'voice-call', kwargs={
-                    'pk': message.organization.id,
+                    'pk': message.organization_id,
                     'msg_id': message.id
                 }
             ), method='POST')
@@ -681,22 +702,20 @@ class RecordCall(View):
             content_type='application/xml'
         )
 
-@method_decorator(decorators, name='dispatch')
+@method_decorator(csrf_exempt, name='dispatch')
 class StatusCallback(View):
-    
-    def post(self, request, **kwargs):
+    http_method_names = ['post']
+
+    @validate_twilio_request
+    @deduplicate_twilio_request
+    async def post(self, request, **kwargs):
         resp = 200
-        org = Organization.objects.get(
-            id=self.kwargs.get('pk'))
         try:
-            callback = self.get_callback_dict(request)
-            log = MessageLog.objects.filter(
-                sid=callback['MessageSid'],
-                contact__phone=callback['To']
-            )
-            if log:
-                log[0].twilio_status = callback['MessageStatus']
-                log[0].save()
+            # Applied to MessageLog in batches by apply_status_callbacks.
+            # Only the direct DB fallback needs the shared sync thread.
+            await sync_to_async(push_status,
+                thread_sensitive=get_redis() is None)(
+                self.get_callback_dict(request))
         except:
             print('STATUS UPDATE FAILED')
             resp = 400
@@ -704,30 +723,35 @@ class StatusCallback(View):
 
     def get_callback_dict(self, request):
         callback_dict = {}
-        for key in ('From','MessageSid','MessageStatus','To'):
+        for key in ('From','MessageSid','MessageStatus','To',
+            'ErrorCode'):
             callback_dict[key] = request.POST.get(key)
         return callback_dict
 
-@method_decorator(decorators, name='dispatch')
+@method_decorator(csrf_exempt, name='dispatch')
 class HarvestResponse(View):
+    http_method_names = ['post']
 
-    def post(self, request, **kwargs):
+    @validate_twilio_request
+    @deduplicate_twilio_request
+    async def post(self, request, **kwargs):
         resp = 200
-        print('starting')
-        org = Organization.objects.get(
-            id=self.kwargs.get('pk'))
+        org = request.organization
         resp_kwargs, save = self.get_response_kwargs(
             request, org)
         if save:
-            response = Response.objects.create(**resp_kwargs)
-            response.add_contact()
+            # Answer Twilio straight away; contact linking, 
+            # tagging and forwarding happen in process_response
+            response = await Response.objects.acreate(**resp_kwargs)
+            tag_ids = []
             if self.kwargs.get('medium') == 'message':
-                resp = self.sms_forward_and_respond(
-                    org, response)
+                reply, tag_ids = await sync_to_async(
+                    response.get_reply)()
+                resp = self.sms_respond(reply)
+            await sync_to_async(process_response.delay, 
+                thread_sensitive=False)(response.id, tag_ids)
         if self.kwargs.get('medium') == 'voice':
-            if request.POST.get('CallStatus') == 'completed':
-                response.forward_voice()
-            else:
+            if request.POST.get('CallStatus') != 'completed':
                 resp = self.voice_forward_and_log(org)
         return HttpResponse(resp)
 
@@ -743,6 +767,7 @@ class HarvestResponse(View):
             kwargs['body'] = request.POST.get('Body', '')
             save = True
         elif medium == 'voice':
+            kwargs['method'] = Response.VOICE
             if request.POST.get('CallStatus') == 'completed':
                 save = True
             # if 'ringing' in request.POST.get('CallStatus'):
@@ -752,10 +777,9 @@ class HarvestResponse(View):
                 'RecordingUrl', '')
         return kwargs, save
 
-    def sms_forward_and_respond(self, org, response):
-        response.forward_sms()
+    def sms_respond(self, reply):
         resp = MessagingResponse()
-        resp.message(org.get_reply_msg(response))
+        resp.message(reply)
         return str(resp)
 
     def voice_forward_and_log(self, org):